@@ -1,91 +1,189 @@
-import sys, wave, math, struct, random, array, re, pyaudio, operator
+import sys, wave, math, struct, random, array, re, operator
 from itertools import islice
+import numpy as np
 from music import *
 import sounds, tabreader
 from sounds import *
-from util import chunk, _int16
+from util import blocks
+from playback import Engine, PyAudioSink
+from writers import WavWriter
+from context import RenderContext
 
 _CHANNELS = 1
 _DEFAULT_SAMPLERATE = 44100
 
 
-def Player (sound, env, notes):
+def Player (sound, env, notes, context=None):
   """
   Tempo is in bars/min. Whereas 120bpm usually means 120 quarter notes per
   minute, we would say 40 bars/min. This makes tempo independent of time
   signature.
+
+  The notes are rendered with context, by default sounds'.
   """
   for pitch, dur in notes:
-    for sample in (env.gen(sound, pitch, dur) if pitch else Silence.gen(dur)):
+    for sample in (env.gen(sound, pitch, dur, context) if pitch
+                   else Silence.gen(dur, context)):
       yield sample
 
-def MultiPlayer (sound, env, musics):
-  for samples in zip(*(Player(sound, env, notes) for notes in musics)):
-    yield sum(samples)/len(samples)
+def MultiPlayer (sound, env, musics, context=None):
+  """
+  Play each of musics at once, until the longest is done.
+  """
+  yield from Mixer(*(Player(sound, env, notes, context) for notes in musics),
+                   context=context)
 
 
+class _Part:
+  """
+  An input to a Mixer, read a block at a time: an iterable of samples, or
+  with blocks, of arrays of them of any size.
+  """
+
+  def __init__ (self, input, weight, blocks):
+    self.input = input
+    self.iter = iter(input)
+    self.weight = weight
+    self.blocks = blocks
+    self.pending = np.empty(0)
+
+  def read (self, n):
+    """
+    Up to n samples. Fewer means the input is done.
+    """
+    if not self.blocks:
+      return np.fromiter(islice(self.iter, n), float)
+
+    parts = [self.pending] if len(self.pending) else []
+    have = len(self.pending)
+    for block in self.iter:
+      parts.append(np.asarray(block, dtype=float))
+      have += len(parts[-1])
+      if have >= n:
+        break
+    if len(parts) == 1:
+      block = parts[0]
+    else:
+      block = np.concatenate(parts) if parts else self.pending
+    self.pending = block[n:]
+    return block[:n]
 
 class Mixer:
+  """
+  Mixes inputs, each times its weight. Each block, every input is read a
+  block's worth at once and added into one buffer, so a part costs a vector
+  multiply and add a block, however many there are.
+
+  Inputs may be of any length. One that runs out drops out, while the rest
+  go on, and the mix ends when all have. Inputs can be added and removed
+  while the mix is playing, from the next block on.
+
+  The mix is scaled by gain, or when that's None, by one over the number of
+  inputs added and not removed, so that parts finishing leave the rest as
+  loud as they were.
+  """
 
-  def __init__ (self, *args):
+  def __init__ (self, *args, gain=None, context=None):
+    # Every input added and not removed, and the parts still playing
     self.inputs = []
+    self.parts = []
+    self.gain = gain
+    self.block_size = (context or sounds.default_context()).block_size
     for arg in args:
-      try:
-        input, weight = arg
-        self.inputs.append((input, weight))
-      except ValueError:
-        self.inputs.append((arg, 1))
-
-  def add (self, input, weight=1):
-    self.inputs.append((input, weight))
+      if isinstance(arg, tuple) and len(arg) == 2:
+        self.add(*arg)
+      else:
+        self.add(arg)
+
+  def add (self, input, weight=1, blocks=False):
+    """
+    Add input, an iterable of samples, or with blocks, of arrays of samples.
+    """
+    self.inputs.append(input)
+    self.parts.append(_Part(input, weight, blocks))
+
+  def remove (self, input):
+    """
+    Take input out of the mix, whether or not it is done.
+    """
+    for i, added in enumerate(self.inputs):
+      if added is input:
+        del self.inputs[i]
+        for part in self.parts:
+          if part.input is input:
+            self.parts.remove(part)
+            break
+        return
+    raise ValueError('That input is not in the mix')
+
+  def blocks (self):
+    """
+    The mix, in blocks of up to block_size samples. Each block is in the
+    same buffer, so is only good until the next is asked for.
+    """
+    size = self.block_size
+    mix = np.empty(size)
+    scratch = np.empty(size)
+    while self.parts:
+      mix[:] = 0
+      longest = 0
+      gain = self.gain if self.gain is not None else 1/max(len(self.inputs), 1)
+      for part in list(self.parts):
+        block = part.read(size)
+        n = len(block)
+        if n < size:
+          self.parts.remove(part)
+        if not n:
+          continue
+        np.multiply(block, part.weight * gain, out=scratch[:n])
+        mix[:n] += scratch[:n]
+        longest = max(longest, n)
+      if longest:
+        yield mix[:longest]
 
   def __iter__ (self):
-    weighted_samples = []
-    for input, weight in self.inputs:
-      weighted_samples.append(samp*weight for samp in input)
-
-    for samps in zip(*weighted_samples):
-      yield sum(samps)/len(samps)
+    for block in self.blocks():
+      yield from block.tolist()
 
 
-def gensound (tempo=33, I=1, H=1, sound=None):
+def gensound (tempo=33, I=1, H=1, sound=None, context=None):
   if sound is None:
     sound = FMSynth(I, H)
   env = Envelope(25, 25, .4, 25)
   return MultiPlayer(sound, env, [PianoRoll(tempo, n)
-                                  for n in tabreader.read(tabreader.ex_tabs)])
+                                  for n in tabreader.read(tabreader.ex_tabs)],
+                     context)
 
-def play (data=None, **kwargs):
+def play (data=None, context=None, **kwargs):
+  """
+  Play data, by default gensound() rendered with context, through PyAudio.
+  """
+  if context is None:
+    context = RenderContext(_DEFAULT_SAMPLERATE, channels=_CHANNELS)
   if data is None:
-    data = gensound(**kwargs)
-
-  sounds.set_samplerate(_DEFAULT_SAMPLERATE)
-  _BUFPERIOD = int(sounds.SAMPLERATE/4)
+    data = gensound(context=context, **kwargs)
 
-  p = pyaudio.PyAudio()
-  out = p.open(rate=_DEFAULT_SAMPLERATE, format=pyaudio.paInt16,
-               channels=_CHANNELS, frames_per_buffer=_BUFPERIOD, output=True,
-              )
+  _BUFPERIOD = int(context.rate/4)
 
-  for bs in chunk(data, _BUFPERIOD*_CHANNELS):
-    out.write(bs)
+  engine = Engine(blocks(iter(data), _BUFPERIOD), PyAudioSink(),
+                  context.rate, context.channels, latency=1,
+                  period=_BUFPERIOD)
+  return engine.run()
 
-  out.close()
-  p.terminate()
-
-def write (filename="out", data=None, **kwargs):
+def write (filename="out", data=None, format='int16', context=None,
+           **kwargs):
+  """
+  Write data, by default gensound(), to filename.wav as it is generated,
+  at the rate of context, by default sounds'.
+  """
+  if context is None:
+    context = sounds.default_context().replace(channels=_CHANNELS)
   if data is None:
-    data = gensound(**kwargs)
-
-  f = wave.open(filename + ".wav", 'w')
-  f.setnchannels(_CHANNELS)
-  f.setsampwidth(2)
-  f.setframerate(sounds.SAMPLERATE)
-  f.setcomptype('NONE', 'not compressed')
+    data = gensound(context=context, **kwargs)
 
-  bytes = array.array('h',(_int16(s) for s in data))
-  f.writeframes(bytes)
-  f.close()
+  with WavWriter(filename + ".wav", format=format, context=context) as f:
+    for block in blocks(iter(data), 4096):
+      f.write(block)
 
 if __name__ == '__main__':
   play()
@@ -0,0 +1,273 @@
+"""
+Benchmarks for both synthesis engines, the tab and note parsers, and PCM
+encoding. Each case renders a fixed duration from fixed seeds, and reports
+its throughput in samples (or, for parsers, items) per second, along with
+the realtime factor for audio.
+
+  python bench.py --save results.json
+  python bench.py --compare results.json --threshold 0.1
+
+Results are kept as JSON, so runs can be compared across commits. A case
+whose throughput falls short of the baseline's by more than the threshold
+counts as a regression, and the run exits non-zero.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from collections import deque
+from itertools import islice
+from time import perf_counter
+import numpy as np
+import sounds, audio, tabreader, music, util, device, filters
+from device import (Synth, SegmentedRamp, Const, ConstFrequency, FMSynth, Mult,
+                    Bias, Vibrato, FourierSaw, Sampler, sample_times,
+                    DEFAULT_SAMPLERATE)
+
+# Seconds of audio each synthesis case renders
+DUR = 2
+SEED = 0
+
+CASES = {}
+
+def case (name, rate=None):
+  """
+  Register fn as the benchmark name. Each run calls fn() to set up, which
+  returns a function to time and the number of samples or items it makes.
+  rate is the sample rate, for cases whose output is audio.
+  """
+  def register (fn):
+    CASES[name] = (fn, rate)
+    return fn
+  return register
+
+def drain (iter):
+  deque(iter, maxlen=0)
+
+
+_waves = {
+  'sine': sounds.SineWave,
+  'square': sounds.SquareWave(),
+  'sawtooth': sounds.SawtoothWave,
+  'triangle': sounds.TriangleWave,
+  'fm': sounds.FMSynth(1, 1),
+}
+
+def _wave_case (name, wave):
+  @case('sounds.{}.gen'.format(name), sounds.SAMPLERATE)
+  def bench ():
+    n = int(sounds.SAMPLERATE * DUR)
+    return lambda: drain(wave.gen(440, DUR)), n
+
+for name, wave in _waves.items():
+  _wave_case(name, wave)
+
+@case('sounds.Envelope.gen', sounds.SAMPLERATE)
+def bench_envelope ():
+  env = sounds.Envelope(25, 25, .4, 25)
+  n = int(sounds.SAMPLERATE * DUR)
+  return lambda: drain(env.gen(sounds.SineWave, 440, DUR)), n
+
+@case('audio.MultiPlayer', sounds.SAMPLERATE)
+def bench_multiplayer ():
+  env = sounds.Envelope(25, 25, .4, 25)
+  musics = [list(music.PianoRoll(33, n))
+            for n in tabreader.read(tabreader.ex_tabs)]
+  n = int(sounds.SAMPLERATE * DUR)
+  return lambda: drain(islice(audio.MultiPlayer(sounds.FMSynth(1, 1), env,
+                                                musics), n)), n
+
+@case('audio.Mixer(64)', sounds.SAMPLERATE)
+def bench_mixer ():
+  # 64 parts of different lengths, in blocks, mixed down to the longest
+  n = int(sounds.SAMPLERATE * DUR)
+  parts = [np.random.uniform(-1, 1, n - i*100) for i in range(64)]
+  def run ():
+    mixer = audio.Mixer()
+    for part in parts:
+      mixer.add((part[i:i+1024] for i in range(0, len(part), 1024)),
+                blocks=True)
+    drain(mixer.blocks())
+  return run, n
+
+def _device_case (name, patch):
+  @case('device.' + name, DEFAULT_SAMPLERATE)
+  def bench ():
+    output = patch()
+    n = int(DUR * DEFAULT_SAMPLERATE) + 1
+    return lambda: drain(Sampler(output, DEFAULT_SAMPLERATE, DUR)), n
+
+def _fm_patch ():
+  envelope = SegmentedRamp(2, steps=((0.06, 0.5), (0.1, 1), (0.9, 1), (1, 0)))
+  oscillator = FMSynth(ConstFrequency(400), B=Mult(1.5, envelope), H=0.2)
+  return Mult(envelope, oscillator)
+
+def _random_steps (n):
+  walk = device.random_walk()
+  return [next(walk) for _ in range(n)]
+
+_device_case('FMSynth+SegmentedRamp', _fm_patch)
+_device_case('Synth+Vibrato', lambda: Synth(
+  _random_steps(8), oscillator=device.Square, modifier=Vibrato(freq=3.2),
+  A=0.13, D=0.03, S=0.5, R=0.5))
+_device_case('Synth+FourierSaw(20)', lambda: Synth(
+  _random_steps(8), oscillator=FourierSaw(20), A=0.03, D=0.03, S=5, R=0.5))
+
+# The per-node overhead of the per-sample path: a chain of nodes, each of
+# which does next to nothing but call its inputs
+CHAIN = 16
+
+def _node_chain ():
+  node = Const(0.5)
+  for i in range(CHAIN // 2):
+    node = Mult(Const(0.9), Bias(Const(0.01), node))
+  return node
+
+@case('device.node.__call__')
+def bench_node_call ():
+  node = _node_chain()
+  t = sample_times(0, int(DUR * DEFAULT_SAMPLERATE) // 10, DEFAULT_SAMPLERATE)
+  return lambda: drain(map(node, t)), len(t) * CHAIN
+
+@case('device.node.render')
+def bench_node_render ():
+  node = _node_chain()
+  blocks = int(DUR * DEFAULT_SAMPLERATE) // 16
+  return (lambda: [node.render(i * 16, 16, DEFAULT_SAMPLERATE)
+                   for i in range(blocks)], blocks * CHAIN)
+
+@case('device.Mult')
+def bench_mult ():
+  carrier = Const(0.5)
+  return lambda: [Mult(0.5, carrier) for i in range(1000)], 1000
+
+@case('filters.Biquad', DEFAULT_SAMPLERATE)
+def bench_biquad ():
+  # A filter swept every block, so the coefficients glide throughout
+  biquad = filters.Biquad('lowpass', 1000, 2)
+  samples = np.random.uniform(-1, 1, int(DUR * DEFAULT_SAMPLERATE))
+  def run ():
+    for i, start in enumerate(range(0, len(samples), 1024)):
+      biquad.process(samples[start:start+1024], DEFAULT_SAMPLERATE,
+                     freq=500 + 4000*(i % 2))
+  return run, len(samples)
+
+@case('tabreader.read')
+def bench_tabreader ():
+  return (lambda: tabreader.read(tabreader.ex_tabs),
+          sum(tab.count('\n') for tab in tabreader.ex_tabs))
+
+@case('music.PianoRoll')
+def bench_pianoroll ():
+  notes = tabreader.read(tabreader.ex_tabs)
+  return (lambda: [drain(music.PianoRoll(33, n)) for n in notes],
+          sum(len(n.split()) for n in notes))
+
+def _samples ():
+  return np.random.uniform(-1, 1, int(DUR * DEFAULT_SAMPLERATE)).tolist()
+
+@case('util.chunk', DEFAULT_SAMPLERATE)
+def bench_chunk ():
+  samples = _samples()
+  return lambda: drain(util.chunk(iter(samples), 1024)), len(samples)
+
+@case('util.byte_array', DEFAULT_SAMPLERATE)
+def bench_byte_array ():
+  samples = _samples()
+  return lambda: util.byte_array(samples), len(samples)
+
+
+def run (names, repeat=3):
+  """
+  Time the named cases, keeping the best of repeat runs of each.
+  """
+  results = {}
+  for name in names:
+    fn, rate = CASES[name]
+    best = None
+    for i in range(repeat):
+      random.seed(SEED)
+      np.random.seed(SEED)
+      timed, n = fn()
+      start = perf_counter()
+      timed()
+      elapsed = perf_counter() - start
+      best = elapsed if best is None else min(best, elapsed)
+
+    results[name] = {
+      'items': n,
+      'seconds': best,
+      'per_second': n / best,
+      'realtime_factor': n / rate / best if rate else None,
+    }
+  return results
+
+def compare (results, baseline, threshold):
+  """
+  The cases in both whose throughput dropped by more than threshold, a
+  fraction, as (name, ratio) pairs.
+  """
+  regressions = []
+  for name, result in results.items():
+    if name in baseline:
+      ratio = result['per_second'] / baseline[name]['per_second']
+      if ratio < 1 - threshold:
+        regressions.append((name, ratio))
+  return regressions
+
+def report (results, baseline=None):
+  print('{:<30} {:>10} {:>14} {:>10} {:>8}'.format(
+    'case', 'seconds', 'per second', 'realtime', 'change'))
+  for name, result in results.items():
+    change = ''
+    if baseline and name in baseline:
+      change = '{:+.1%}'.format(result['per_second'] /
+                                baseline[name]['per_second'] - 1)
+    realtime = result['realtime_factor']
+    print('{:<30} {:>10.4f} {:>14.0f} {:>10} {:>8}'.format(
+      name, result['seconds'], result['per_second'],
+      '{:.1f}x'.format(realtime) if realtime else '-', change))
+
+def main (argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('cases', nargs='*',
+                      help='Cases to run, by name or prefix. Default: all.')
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--save', help='Write the results to this JSON file.')
+  parser.add_argument('--compare', help='A JSON file of earlier results.')
+  parser.add_argument('--threshold', type=float, default=0.1,
+                      help='The slowdown that counts as a regression.')
+  args = parser.parse_args(argv)
+
+  names = [name for name in CASES
+           if not args.cases or any(name.startswith(prefix)
+                                    for prefix in args.cases)]
+  results = run(names, args.repeat)
+
+  baseline = None
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)['results']
+  report(results, baseline)
+
+  if args.save:
+    with open(args.save, 'w') as f:
+      json.dump({
+        'time': time.time(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'dur': DUR,
+        'results': results,
+      }, f, indent=2)
+
+  if baseline:
+    regressions = compare(results, baseline, args.threshold)
+    for name, ratio in regressions:
+      print('Regression: {} at {:.0%} of baseline'.format(name, ratio))
+    return 1 if regressions else 0
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
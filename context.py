@@ -0,0 +1,50 @@
+"""
+Render contexts: the sample rate, block size, channels and sample type a
+render is made with. Whatever renders takes one, so that renders at
+different rates can run side by side in one process. Left out, each
+module's globals make the default.
+"""
+import numpy as np
+
+class RenderContext:
+  """
+  rate: samples per second.
+  block_size: samples in each block rendered.
+  channels: channels written or played.
+  dtype: the numpy type of the samples rendered.
+  """
+
+  def __init__ (self, rate=44100, block_size=1024, channels=1,
+                dtype='float64'):
+    self.rate = rate
+    self.block_size = block_size
+    self.channels = channels
+    self.dtype = np.dtype(dtype)
+
+  @property
+  def sample_dur (self):
+    """
+    The duration of a sample, in milliseconds.
+    """
+    return 1000 / self.rate
+
+  def replace (self, **changes):
+    """
+    A context like this one, with changes.
+    """
+    params = dict(rate=self.rate, block_size=self.block_size,
+                  channels=self.channels, dtype=self.dtype)
+    params.update(changes)
+    return RenderContext(**params)
+
+  def __eq__ (self, other):
+    return (isinstance(other, RenderContext) and
+            (self.rate, self.block_size, self.channels, self.dtype) ==
+            (other.rate, other.block_size, other.channels, other.dtype))
+
+  def __hash__ (self):
+    return hash((self.rate, self.block_size, self.channels, self.dtype))
+
+  def __repr__ (self):
+    return ('RenderContext(rate={}, block_size={}, channels={}, dtype={})'
+            .format(self.rate, self.block_size, self.channels, self.dtype))
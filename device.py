@@ -1,19 +1,96 @@
 from collections import deque
+from functools import lru_cache, wraps
 from math import sin, cos, floor, pi, log10
 from numbers import Number
 from util import NamedDescriptor, NamedMeta, configable, clamp
+from wavetable import Wavetable, fourier_table
+from schedule import Scheduler, notes, note_events, ON, OFF
+from context import RenderContext
+import numpy as np
 import operator
 
 _tau = 2*pi
 
+# The default context, for renders not given one
+CHANNELS = 1
+DEFAULT_SAMPLERATE = 44100//2
+DEFAULT_BLOCKSIZE = 1024
+# Samples over which Poly measures a voice's level
+LEVEL_WINDOW = 1024
+
+def default_context ():
+  return RenderContext(DEFAULT_SAMPLERATE, DEFAULT_BLOCKSIZE, CHANNELS)
+
 class SpaceTimeContinuumError (Exception):
   pass
 
+class SeekError (Exception):
+  pass
+
+def sample_times (start, n, rate):
+  """
+  The times of the n samples beginning at sample index start.
+  """
+  return (start + np.arange(n)) / rate
+
+def render_input (input, start, n, rate):
+  """
+  Render a block of an input, which may be a Signal, a plain callable of t, or
+  a constant. Constants are returned as they are, to be broadcast.
+  """
+  if isinstance(input, Signal):
+    return input.render(start, n, rate)
+  if callable(input):
+    return np.fromiter(map(input, sample_times(start, n, rate)), float, n)
+  return input
+
+def _random_access (input):
+  """
+  Whether any span of input can be rendered at any time, as nothing in the
+  graph behind it carries state from one block to the next.
+  """
+  if not isinstance(input, Signal):
+    return True
+  return input.random_access and all(_random_access(input)
+                                     for key, input in input.inputs())
+
+def stateful (render):
+  """
+  For render methods of nodes that carry state from one block to the next.
+  When several consumers ask for the same block, it is rendered once and
+  replayed to the rest, just as a repeated t is in the per-sample path.
+  """
+  memo = '_memo_' + render.__name__
+
+  @wraps(render)
+  def fn (self, start, n, rate):
+    key = (start, n, rate)
+    last = getattr(self, memo, None)
+    if last is not None and last[0] == key:
+      return last[1]
+    block = render(self, start, n, rate)
+    setattr(self, memo, (key, block))
+    return block
+  return fn
+
 class Signal (metaclass=NamedMeta):
   """
   Signals normally operate over [-1,1]. A subclass may change this.
   """
 
+  # A pure signal's output depends only on its inputs' values at t, so it is
+  # itself constant when they are.
+  pure = False
+  # Whether its blocks can be rendered in any order, as nothing carries over
+  # from one to the next.
+  random_access = True
+  # Whether it changes slowly enough to be evaluated at control rate. May be
+  # set on a node to mark it so.
+  control = False
+  # The state carried from one sample or block to the next, by attribute
+  # name, with the values it starts from.
+  _initial = {}
+
   #last_t = -1
   #last_samp = None
 
@@ -33,13 +110,95 @@ class Signal (metaclass=NamedMeta):
     #return samp
     pass
 
+  @stateful
+  def render (self, start, n, rate):
+    """
+    Render n samples beginning at sample index start as an array. Each call
+    must continue where the last left off, or repeat it.
+
+    This fallback samples the signal one t at a time. Subclasses override it
+    to render the whole block at once.
+    """
+    return np.fromiter(map(self, sample_times(start, n, rate)), float, n)
+
+  def inputs (self):
+    """
+    The inputs this node reads, as (key, input) pairs. A key can be handed to
+    rewire() to swap that input for another.
+    """
+    seen = set()
+    for cls in type(self).__mro__:
+      for var in vars(cls).values():
+        if isinstance(var, Input) and var.varname not in seen:
+          seen.add(var.varname)
+          if hasattr(self, var.varname):
+            yield var.varname, getattr(self, var.varname)
+
+  def rewire (self, key, input):
+    """
+    Replace an input as is, without the conversion its Input would apply.
+    """
+    setattr(self, key, input)
+    if hasattr(self, '_call' + key):
+      setattr(self, '_call' + key, _bound(input))
+
+  def snapshot (self):
+    """
+    This node's state, as plain data that restore() takes back.
+    """
+    return {name: getattr(self, name) for name in self._initial}
+
+  def restore (self, state):
+    for name, value in state.items():
+      setattr(self, name, value)
+    # Memoized blocks belong to the old state
+    for name in [name for name in vars(self) if name.startswith('_memo_')]:
+      delattr(self, name)
+
+  def reset (self):
+    """
+    Return to the state before the first sample.
+    """
+    self.restore(self._initial)
+
+  def seek (self, index, rate, block_size=DEFAULT_BLOCKSIZE):
+    """
+    Take the state this node would have after rendering every sample before
+    index from the start. A node with state gets there by running itself
+    over that span, without rendering the rest of the graph, so its inputs
+    must be random access, or SeekError is raised.
+    """
+    if self.random_access:
+      self.reset()
+      return
+
+    for key, input in self.inputs():
+      if not _random_access(input):
+        raise SeekError('{} cannot seek, as its {} input has state'
+                        .format(type(self).__name__, key))
+    self.reset()
+    for start in range(0, index, block_size):
+      self.advance(start, min(block_size, index - start), rate)
+
+  def advance (self, start, n, rate):
+    """
+    Carry the state on over n samples from start, when the output isn't
+    wanted. By default, by rendering them.
+    """
+    self.render(start, n, rate)
+
 class Const (Signal):
+  pure = True
+
   def __init__ (self, val):
     self.val = val if val is not None else 0
 
   def __call__ (self, t):
     return self.val
 
+  def render (self, start, n, rate):
+    return self.val
+
 def asInput (input, type=None, const_type=Const, **kwargs):
   if not isinstance(input, Signal):
     if const_type is None:
@@ -55,28 +214,45 @@ def asInput (input, type=None, const_type=Const, **kwargs):
 
   return input
 
+def _bound (input):
+  """
+  A Signal's __call__, bound, to sample it through without looking the
+  method up on its type every time. Anything else is kept as it is.
+  """
+  return input.__call__ if isinstance(input, Signal) else input
+
 class Input (NamedDescriptor):
+  """
+  An input of a node, converted to a Signal as it is set. The node keeps it
+  under '_' + its name, and what to sample it through, for per-sample
+  __call__ methods, under '_call_' + its name.
+  """
   def __init__ (self, type=None, const_type=Const, **kwargs):
     self.type = type
     self.const_type = const_type
     self.kwargs = kwargs
 
   def __set__ (self, instance, value):
-    super().__set__(instance, asInput(value, self.type,
-                                      const_type=self.const_type,
-                                      **self.kwargs))
+    value = asInput(value, self.type, const_type=self.const_type,
+                    **self.kwargs)
+    super().__set__(instance, value)
+    setattr(instance, '_call' + self.varname, _bound(value))
 
 class FrequencySignal (Signal):
   """
   Frequency channels operate over [0,11000]
   """
+  pure = True
   input = Input()
 
   def __init__ (self, input):
     self.input = input
 
   def __call__ (self, t):
-    return (self._input(t)+1)*5500
+    return (self._call_input(t)+1)*5500
+
+  def render (self, start, n, rate):
+    return (self._input.render(start, n, rate)+1)*5500
 
 class ConstFrequency (Const, FrequencySignal):
   def __init__ (self, val):
@@ -90,6 +266,8 @@ class TriggerSignal (Signal):
   threshold. Only after the input signal has dropped below the threshold will
   the TriggerSignal be ready to be triggered again.
   """
+  random_access = False
+  _initial = {'hot': False}
   input = Input()
   thresh = Input()
 
@@ -99,8 +277,8 @@ class TriggerSignal (Signal):
     self.hot = False
 
   def __call__ (self, t):
-    samp = self.input(t)
-    thresh = self.thresh(t)
+    samp = self._call_input(t)
+    thresh = self._call_thresh(t)
 
     if not self.hot and samp >= thresh:
       self.hot = True
@@ -111,9 +289,35 @@ class TriggerSignal (Signal):
 
     return 0
 
+  @stateful
+  def render (self, start, n, rate):
+    above = (np.broadcast_to(self.input.render(start, n, rate), n) >=
+             self.thresh.render(start, n, rate))
+    was_above = np.concatenate(([self.hot], above[:-1]))
+    self.hot = bool(above[-1])
+    return (above & ~was_above).astype(float)
+
 class Trigger (TriggerSignal):
-  def __init__ (self):
+  """
+  A trigger fired by hand. In block rendering, a trigger with a source takes
+  its firings from the source's events instead. Sampled one t at a time, a
+  firing is seen by everything that reads it at the same t.
+  """
+  _initial = {'firing': False, 'fired': None}
+
+  def __init__ (self, source=None):
     self.firing = False
+    self.fired = None
+    self.source = source
+
+  @property
+  def random_access (self):
+    return self.source is not None
+
+  def inputs (self):
+    yield from super().inputs()
+    if self.source is not None:
+      yield 'source', self.source
 
   def fire (self):
     self.firing = True
@@ -121,14 +325,26 @@ class Trigger (TriggerSignal):
   def __call__ (self, t):
     if self.firing:
       self.firing = False
-      return 1
-    return 0
+      self.fired = t
+    return 1 if t == self.fired else 0
+
+  @stateful
+  def render (self, start, n, rate):
+    if self.source is not None:
+      return self.source.events(start, n, rate)[1]
+
+    block = np.zeros(n)
+    if self.firing:
+      self.firing = False
+      block[0] = 1
+    return block
 
 class GateSignal (Signal):
   """
   Outputs a sample of 1 if the input signal is >= the threshold, otherwise the
   output is 0.
   """
+  pure = True
   input = Input()
   thresh = Input()
 
@@ -137,11 +353,32 @@ class GateSignal (Signal):
     self.thresh = thresh
 
   def __call__ (self, t):
-    return 0 if self.input(t) < self.thresh(t) else 1
+    return 0 if self._call_input(t) < self._call_thresh(t) else 1
+
+  def render (self, start, n, rate):
+    return np.where(self.input.render(start, n, rate) <
+                    self.thresh.render(start, n, rate), 0., 1.)
 
 class Gate (GateSignal):
-  def __init__ (self):
+  """
+  A gate opened and closed by hand. In block rendering, a gate with a source
+  takes its state from the source's events instead.
+  """
+  pure = False
+  _initial = {'open': 0}
+
+  def __init__ (self, source=None):
     self.open = 0
+    self.source = source
+
+  @property
+  def random_access (self):
+    return self.source is not None
+
+  def inputs (self):
+    yield from super().inputs()
+    if self.source is not None:
+      yield 'source', self.source
 
   def on (self):
     self.open = 1
@@ -152,17 +389,147 @@ class Gate (GateSignal):
   def __call__ (self, t):
     return self.open
 
+  def render (self, start, n, rate):
+    if self.source is not None:
+      return self.source.events(start, n, rate)[2]
+    return self.open
+
 class PositiveSignal (Signal):
+  pure = True
   input = Input()
 
   def __init__ (self, input):
     self.input = input
 
   def __call__ (self, t):
-    return (self._input(t) + 1)/2
+    return (self._call_input(t) + 1)/2
+
+  def render (self, start, n, rate):
+    return (self._input.render(start, n, rate) + 1)/2
+
+# Segment shapes for Breakpoints: each maps x, the way through the segment
+# from 0 to 1, to the way from its first value to its last.
+_curves = {
+  'linear': lambda x, power: x,
+  'poly': lambda x, power: x**power,
+  'exp': lambda x, power: (10**x - 1)/9,
+  'log': lambda x, power: np.log10(x*9 + 1),
+  'hold': lambda x, power: 0*x,
+}
+
+class Breakpoints (Signal):
+  """
+  A curve through (time, value) points, held level before the first and
+  after the last. Each segment is shaped by its curve, one of _curves, with
+  'poly' raised to its power. curves and powers may be given per segment.
 
-class LinearRamp (Signal):
+  Points are kept in sorted arrays, so any time can be sampled, in any order,
+  with a binary search, and a block of them all at once.
+  """
+  control = True
+  def __init__ (self, times, values, curves='linear', powers=2):
+    self.times = np.asarray(times, dtype=float)
+    self.values = np.asarray(values, dtype=float)
+    if not len(self.times) or self.times.shape != self.values.shape:
+      raise ValueError('Breakpoints need as many values as times, and some')
+    if np.any(np.diff(self.times) < 0):
+      raise ValueError('Breakpoint times must be in order')
+
+    segments = max(len(self.times) - 1, 1)
+    names = list(_curves)
+    if isinstance(curves, str):
+      curves = [curves]
+    self.curves = np.broadcast_to([names.index(c) for c in curves],
+                                  segments)
+    self.powers = np.broadcast_to(np.asarray(powers, dtype=float), segments)
+
+    # The curve as arrays by segment, for at() to index with one search of
+    # _edges: a level before the first point and after the last, and each
+    # 'hold' a segment whose value doesn't move
+    inner = len(self.times) - 1
+    spans = np.diff(self.times)
+    codes = self.curves[:inner]
+    self._edges = self.times
+    self._starts = np.concatenate((self.times[:1], self.times))
+    self._scales = np.concatenate(
+      ([0], np.divide(1, spans, out=np.zeros(inner), where=spans > 0), [0]))
+    self._v0 = np.concatenate((self.values[:1], self.values))
+    self._dv = np.concatenate(
+      ([0], np.where(codes == names.index('hold'), 0, np.diff(self.values)),
+       [0]))
+    self._codes = np.concatenate(([0], codes, [0]))
+    self._powers = np.concatenate(([1], self.powers[:inner], [1]))
+    self._shapes()
+
+  def _shapes (self):
+    """
+    Find whether the segments that move all have one curve and one power,
+    which at() then applies to a block in one go. Those that don't move come
+    out level whatever they're given.
+    """
+    moving = self._dv != 0
+    codes = np.unique(self._codes[moving])
+    powers = np.unique(self._powers[moving])
+    self._shape = None
+    if len(codes) < 2:
+      self._shape = self._curve(codes[0] if len(codes) else 0)
+    self._power = None
+    if len(powers) < 2:
+      self._power = powers[0] if len(powers) else 1
+
+  def hold (self, after):
+    """
+    From just after time after, hold the value of the last point reached,
+    rather than ramping on to the next.
+    """
+    split = np.nextafter(after, np.inf)
+    k = np.searchsorted(self._edges, split, 'right')
+    # The segment split crosses goes on level past it
+    self._edges = np.insert(self._edges, k, split)
+    self._starts = np.insert(self._starts, k, self._starts[k])
+    self._scales = np.insert(self._scales, k, self._scales[k])
+    self._v0 = np.insert(self._v0, k, self._v0[k])
+    self._dv = np.insert(self._dv, k, self._dv[k])
+    self._codes = np.insert(self._codes, k, self._codes[k])
+    self._powers = np.insert(self._powers, k, self._powers[k])
+    self._scales[k+1:] = 0
+    self._dv[k+1:] = 0
+    self._shapes()
+
+  def __call__ (self, t):
+    return float(self.at(t)[0])
+
+  def render (self, start, n, rate):
+    return self.at(sample_times(start, n, rate))
+
+  def at (self, t):
+    """
+    Sample the curve at t, a time or an array of them.
+    """
+    t = np.atleast_1d(np.asarray(t, dtype=float))
+    k = np.searchsorted(self._edges, t, 'right')
+    x = (t - self._starts[k]) * self._scales[k]
+    v0 = self._v0[k]
+    dv = self._dv[k]
+    power = self._powers[k] if self._power is None else self._power
+    if self._shape is not None:
+      return v0 + dv*self._shape(x, power)
+
+    block = np.empty(t.shape)
+    codes = self._codes[k]
+    for code in np.unique(codes):
+      mask = codes == code
+      block[mask] = v0[mask] + dv[mask]*self._curve(code)(
+        x[mask], power if self._power is not None else power[mask])
+    return block
+
+  @staticmethod
+  def _curve (code):
+    return list(_curves.values())[code]
+
+class LinearRamp (Breakpoints):
   def __init__ (self, t_start, dur, begin=-1, end=1):
+    super().__init__((t_start, t_start + dur), (begin, end))
     self.t_start = t_start
     self.dur = dur
     self.begin = begin
@@ -176,42 +543,24 @@ class LinearRamp (Signal):
 
     return (t - self.t_start) / self.dur * (self.end - self.begin) + self.begin
 
-class SegmentedRamp (Signal):
+class SegmentedRamp (Breakpoints):
+  """
+  Ramps from 0 through steps of (time, value), with times as fractions of
+  dur and values scaled from [0,1] to [low,high]. Past dur, each value is
+  held rather than ramped to the next. The steps are read up front.
+  """
   def __init__ (self, dur, steps, low=0, high=1):
+    steps = list(steps)
+    super().__init__([0] + [start_t*dur for start_t, val in steps],
+                     [0] + [(high - low)*val + low for start_t, val in steps])
+    self.hold(dur)
     self.dur = dur
-    self.steps = iter(steps)
     self.low = low
     self.high = high
-    self.next_t = 0
-    self.next_val = 0
-    self._next()
-
-  def _next (self):
-    self.cur_t = self.next_t
-    self.cur_val = self.next_val
-
-    start_t, val = next(self.steps)
-    start_t *= self.dur
-    val = (self.high - self.low) * val + self.low
 
-    self.next_t = start_t
-    self.next_val = val
-
-  def __call__ (self, t):
-    try:
-      while self.next_t <= t:
-        self._next()
-    except StopIteration:
-      return self.cur_val
-
-    if t > self.dur:
-      return self.cur_val
-
-    return ((t - self.cur_t) / (self.next_t - self.cur_t) *
-            (self.next_val - self.cur_val) + self.cur_val)
-
-class PolyRamp (Signal):
+class PolyRamp (Breakpoints):
   def __init__ (self, t_start, dur, power=2):
+    super().__init__((t_start, t_start + dur), (-1, 1), 'poly', power)
     self.t_start = t_start
     self.dur = dur
     self.power = power
@@ -224,8 +573,9 @@ class PolyRamp (Signal):
 
     return ((t - self.t_start)/self.dur)**self.power * 2 - 1
 
-class ExpRamp (Signal):
+class ExpRamp (Breakpoints):
   def __init__ (self, t_start, dur):
+    super().__init__((t_start, t_start + dur), (-1, 1), 'exp')
     self.t_start = t_start
     self.dur = dur
 
@@ -237,8 +587,9 @@ class ExpRamp (Signal):
 
     return (10**((t - self.t_start)/self.dur) - 1)/9 * 2 - 1
 
-class LogRamp (Signal):
+class LogRamp (Breakpoints):
   def __init__ (self, t_start, dur):
+    super().__init__((t_start, t_start + dur), (-1, 1), 'log')
     self.t_start = t_start
     self.dur = dur
 
@@ -252,6 +603,11 @@ class LogRamp (Signal):
 
 
 class ADSREnvelope (PositiveSignal):
+  pure = False
+  control = True
+  random_access = False
+  _initial = {'start_A': None, 'start_R': None, 'last_samp': 0,
+              'last_t': -1/DEFAULT_SAMPLERATE}
   A = Input()
   D = Input()
   S = Input()
@@ -275,17 +631,17 @@ class ADSREnvelope (PositiveSignal):
 
 
   def __call__ (self, t):
-    trigger = self._trigger(t)
-    gate = self._gate(t)
+    trigger = self._call_trigger(t)
+    gate = self._call_gate(t)
     if trigger:
       self.start_A = t
       self.start_R = None
 
     samp = 0
-    S = self._S(t)
+    S = self._call_S(t)
     if gate:
-      A = self._A(t)
-      D = self._D(t)
+      A = self._call_A(t)
+      D = self._call_D(t)
       start_D = self.start_A + A
       start_S = start_D + D
       if self.start_A <= t < start_D:
@@ -303,7 +659,7 @@ class ADSREnvelope (PositiveSignal):
       if not self.start_R:
         self.start_R = t
 
-      R = self._R(t)
+      R = self._call_R(t)
       if self.start_R <= t < self.start_R + R:
         samp = (self.last_samp -
                 self.last_samp/(self.start_R + R - t)*(t - self.last_t))
@@ -312,6 +668,112 @@ class ADSREnvelope (PositiveSignal):
     self.last_t = t
     return samp
 
+  @stateful
+  def render (self, start, n, rate):
+    trigger, gate, A, D, S, R = (
+      input.render(start, n, rate)
+      for input in (self._trigger, self._gate, self._A, self._D, self._S,
+                    self._R))
+    if any(map(np.ndim, (A, D, S, R))):
+      return self._render_samples(start, n, rate, trigger, gate, A, D, S, R)
+
+    # Summed up, the recurrences of __call__ make each stage a straight line
+    # from the level the envelope had on the sample before, reaching its goal
+    # a sample ahead of the stage's end. So a block is rendered a run at a
+    # time, between triggers and gate changes, with each stage of a run
+    # filled in closed form.
+    t = sample_times(start, n, rate)
+    dt = 1/rate
+    # Broadcast as they are compared, constants or not
+    trigger = np.not_equal(trigger, 0, out=np.empty(n, dtype=bool))
+    gate = np.not_equal(gate, 0, out=np.empty(n, dtype=bool))
+    # Runs start at 0 and on triggers and gate changes
+    edges = trigger[1:] | (gate[1:] != gate[:-1])
+    bounds = [0, *(np.flatnonzero(edges) + 1).tolist(), n]
+    block = np.zeros(n)
+    last_samp = self.last_samp
+    last_t = self.last_t
+
+    for i, j in zip(bounds, bounds[1:]):
+      if trigger[i]:
+        self.start_A = t[i]
+        self.start_R = None
+        # Attack from the sample before, even if rendering was skipped
+        last_t = max(last_t, t[i] - dt)
+
+      run = t[i:j]
+      if gate[i]:
+        if self.start_A is not None:
+          start_D = self.start_A + A
+          start_S = start_D + D
+          a = i + np.searchsorted(run, start_D)
+          s = i + np.searchsorted(run, start_S)
+          if a > i:
+            block[i:a] = (last_samp + (1 - last_samp) *
+                          (t[i:a] - last_t)/(start_D - dt - last_t))
+          if s > a:
+            block[a:s] = 1 - (t[a:s] - start_D)*(1-S)/D
+          block[s:j] = S
+      elif last_samp:
+        if not self.start_R:
+          self.start_R = t[i]
+
+        end_R = self.start_R + R
+        r = i + np.searchsorted(run, end_R)
+        if r > i:
+          block[i:r] = (last_samp * (end_R - dt - t[i:r]) /
+                        (end_R - dt - last_t))
+
+      last_samp = block[j-1]
+      last_t = t[j-1]
+
+    self.last_samp = last_samp
+    self.last_t = last_t
+    return block
+
+  def _render_samples (self, start, n, rate, trigger, gate, A, D, S, R):
+    """
+    The same recurrences as __call__, for parameters that change over the
+    block, over plain floats rather than through a call per sample.
+    """
+    ts = sample_times(start, n, rate).tolist()
+    trigger, gate, A, D, S, R = (np.broadcast_to(input, n).tolist()
+                                 for input in (trigger, gate, A, D, S, R))
+    block = [0]*n
+    last_samp = self.last_samp
+    last_t = self.last_t
+
+    for i, t in enumerate(ts):
+      if trigger[i]:
+        self.start_A = t
+        self.start_R = None
+        last_t = max(last_t, t - 1/rate)
+
+      samp = 0
+      if gate[i]:
+        start_D = self.start_A + A[i]
+        start_S = start_D + D[i]
+        if self.start_A <= t < start_D:
+          samp = last_samp + (1 - last_samp)/(start_D - t)*(t - last_t)
+        elif start_D <= t < start_S:
+          samp = 1 - (t - start_D)*(1-S[i])/D[i]
+        else:
+          samp = S[i]
+      elif last_samp:
+        if not self.start_R:
+          self.start_R = t
+
+        end_R = self.start_R + R[i]
+        if self.start_R <= t < end_R:
+          samp = last_samp - last_samp/(end_R - t)*(t - last_t)
+
+      block[i] = last_samp = samp
+      last_t = t
+
+    self.last_samp = last_samp
+    self.last_t = last_t
+    return np.array(block)
+
 def p2f (p):
   """
   Pitch signal is defined in the range [-1,1].
@@ -330,60 +792,133 @@ def f2p (f):
   return f/5500 - 1
 
 class PhasedSignal (Signal):
+  """
+  An oscillator reading one cycle of _phase, a table of any length, with a
+  24 bit phase accumulator. A subclass with a _wavetable reads that instead,
+  band-limited for the frequency and interpolated.
+
+  Wherever sync, if given, fires, the phase starts again from 0.
+  """
   #freq = Input(FrequencySignal, const_type=ConstFrequency)
   freq = Input(FrequencySignal, const_type=None)
+  sync = Input(TriggerSignal)
+  _call_sync = None
 
-  def __init__ (self, freq=None):
+  random_access = False
+  _initial = {'pa': 0, 'last_t': 0, 'inc': 0}
+  _wavetable = None
+  interpolation = 'linear'
+
+  def __init__ (self, freq=None, sync=None):
     self.freq = freq
+    if sync is not None:
+      self.sync = sync
     self.pa = 0
     self.last_t = 0
+    self.inc = 0
 
   def __call__ (self, t):
+    # Read before freq, which may be what fires it, for it to be seen a
+    # sample after it fires, as every other reader sees it. The phase is
+    # then a sample on from 0.
+    sync = self._call_sync is not None and self._call_sync(t)
     dt = t - self.last_t
     self.last_t = t
-    f = self._freq
+    f = self._call_freq
     if callable(f):
       f = f(t)
     df = floor(dt*f * 2.0**24)
-    self.pa = (self.pa + df) & 0xFFFFFF
-    return self._phase[self.pa >> 14]
+    self.pa = (0 if sync else self.pa) + df & 0xFFFFFF
+    if self._wavetable is None:
+      return self._phase[(self.pa * len(self._phase)) >> 24]
+
+    if dt:
+      self.inc = df / 2.0**24
+    return float(self._wavetable.lookup(self.pa / 2.0**24, self.inc,
+                                        self.interpolation))
+
+  def advance (self, start, n, rate):
+    """
+    Step the phase accumulator over a block. Returns the phase and the
+    increment of each sample, in 24 bit fixed point.
+    """
+    t = sample_times(start, n, rate)
+    dt = np.empty(n)
+    dt[0] = t[0] - self.last_t
+    np.subtract(t[1:], t[:-1], out=dt[1:])
+    f = render_input(self._freq, start, n, rate)
+    df = np.floor(dt*f * 2.0**24).astype(np.int64)
+    pa = self.pa + np.cumsum(df)
+    if hasattr(self, '_sync'):
+      sync = np.broadcast_to(self._sync.render(start, n, rate), n)
+      for i in np.flatnonzero(sync):
+        pa[i:] -= pa[i]
+    pa &= 0xFFFFFF
+    self.pa = int(pa[-1])
+    self.last_t = t[-1]
+    self.inc = df[-1] / 2.0**24
+    return pa, df
+
+  @stateful
+  def render (self, start, n, rate):
+    pa, df = self.advance(start, n, rate)
+    if self._wavetable is None:
+      return np.asarray(self._phase)[(pa * len(self._phase)) >> 24]
+
+    return self._wavetable.lookup(pa / 2.0**24, df / 2.0**24,
+                                  self.interpolation)
 
 class Sine (PhasedSignal):
-  _phase = [sin(_tau*p/1024) for p in range(1024)]
+  _phase = np.array([sin(_tau*p/1024) for p in range(1024)])
 
 class Cosine (PhasedSignal):
-  _phase = [cos(_tau*p/1024) for p in range(1024)]
+  _phase = np.array([cos(_tau*p/1024) for p in range(1024)])
 
 class Saw (PhasedSignal):
-  _phase = [1 - 2*p/1024 for p in range(1024)]
+  _phase = np.array([1 - 2*p/1024 for p in range(1024)])
+  _wavetable = Wavetable(_phase)
 
 class Square (PhasedSignal):
-  _phase = [1 if p/1024 < 1/2 else -1 for p in range(1024)]
+  _phase = np.array([1 if p/1024 < 1/2 else -1 for p in range(1024)])
+  _wavetable = Wavetable(_phase)
 
 class Triangle (PhasedSignal):
-  _phase = [2*abs(Saw._phase[(p - 256) % 1024]) - 1 for p in range(1024)]
-
-def FourierSaw (harmonics):
-  class FourierSaw (PhasedSignal):
-    _phase = [2/pi * sum(sin(_tau*h * p/1024)/h for h in range(1, harmonics+1))
-              for p in range(1024)]
-  return FourierSaw
-
-def FourierSquare (harmonics):
-  class FourierSquare (PhasedSignal):
-    _phase = [4/pi * sum(sin(_tau*(2*h - 1) * p/1024)/(2*h - 1)
-                         for h in range(1, harmonics+1))
-              for p in range(1024)]
-  return FourierSquare
-
-def FourierTriangle (harmonics):
-  class FourierTriangle (PhasedSignal):
-    _phase = [8/pi**2 * sum((-1)**h * sin(_tau*(2*h - 1) * p/1024)/(2*h - 1)**2
-                         for h in range(1, harmonics+1))
-              for p in range(1024)]
-  return FourierTriangle
+  _phase = np.array([2*abs(Saw._phase[(p - 256) % 1024]) - 1
+                     for p in range(1024)])
+  _wavetable = Wavetable(_phase)
+
+def BandLimited (oscillator, size=2048, interpolation='linear'):
+  """
+  A PhasedSignal class like oscillator, but reading band-limited tables of
+  size samples built from its _phase.
+
+  interpolation: 'linear', 'cubic', or None for none.
+  """
+  class BandLimited (oscillator):
+    _wavetable = Wavetable(oscillator._phase, size)
+
+  BandLimited.interpolation = interpolation
+  return BandLimited
+
+@lru_cache(maxsize=None)
+def _Fourier (shape, harmonics, size):
+  class Fourier (PhasedSignal):
+    _phase = fourier_table(shape, harmonics, size)
+
+  Fourier.__name__ = Fourier.__qualname__ = 'Fourier' + shape.title()
+  return Fourier
+
+def FourierSaw (harmonics, size=1024):
+  return _Fourier('saw', harmonics, size)
+
+def FourierSquare (harmonics, size=1024):
+  return _Fourier('square', harmonics, size)
+
+def FourierTriangle (harmonics, size=1024):
+  return _Fourier('triangle', harmonics, size)
 
 class Amp (Signal):
+  pure = True
   input = Input()
   ratio = Input(PositiveSignal)
 
@@ -392,11 +927,30 @@ class Amp (Signal):
     self.input = input
 
   def __call__ (self, t):
-    return self._ratio(t) * self._input(t)
+    return self._call_ratio(t) * self._call_input(t)
+
+  def render (self, start, n, rate):
+    return (self._ratio.render(start, n, rate) *
+            self._input.render(start, n, rate))
 
 def BinaryMod (func):
-  def Mod (mod, carrier):
-    class BinaryMod (type(carrier)):
+  # One class for each type of carrier, made the first time it's needed
+  @lru_cache(maxsize=None)
+  def mod_class (carrier_type):
+    class BinaryMod (carrier_type):
+      pure = True
+      random_access = True
+      # Slow only if both inputs are, which control() sees as it's pure
+      control = False
+      _initial = {}
+      # It has no state, whatever the carrier keeps of its own
+      seek = Signal.seek
+      snapshot = Signal.snapshot
+      restore = Signal.restore
+      reset = Signal.reset
+      # Its inputs are left and right, not the carrier's
+      inputs = Signal.inputs
+      rewire = Signal.rewire
       left = Input()
       right = Input()
 
@@ -405,9 +959,16 @@ def BinaryMod (func):
         self.right = right
 
       def __call__ (self, t):
-        return func(self._left(t), self._right(t))
+        return func(self._call_left(t), self._call_right(t))
 
-    return BinaryMod(mod, carrier)
+      def render (self, start, n, rate):
+        return func(self._left.render(start, n, rate),
+                    self._right.render(start, n, rate))
+
+    return BinaryMod
+
+  def Mod (mod, carrier):
+    return mod_class(type(carrier))(mod, carrier)
 
   return Mod
 
@@ -433,6 +994,7 @@ Bias = BinaryMod(operator.add)
   #return Mult(factor, carrier)
 
 class OldBias (Signal):
+  pure = True
   input = Input()
   offset = Input()
 
@@ -441,50 +1003,357 @@ class OldBias (Signal):
     self.input = input
 
   def __call__ (self, t):
-    return self._offset(t) + self._input(t)
+    return self._call_offset(t) + self._call_input(t)
+
+  def render (self, start, n, rate):
+    return (self._offset.render(start, n, rate) +
+            self._input.render(start, n, rate))
 
 class Sequence (Signal):
+  """
+  Steps through (value, dur) steps, where a value of None is a rest. Each
+  note sets the value, fires the trigger and opens the gate. Rests, and the
+  end of the steps, close the gate and hold the value.
+
+  Blocks are rendered from the events alone, so any span can be, at any
+  time. Only sampling one t at a time keeps a place in the steps, taking t
+  to be at DEFAULT_SAMPLERATE. Either way, each event falls on the sample
+  nearest it.
+  """
+  pure = False
+  _initial = {'pos': 0, 'value': 0}
+
   def __init__ (self, steps=[]):
-    self.steps = iter(steps)
-    self.until = -1
+    self.steps = notes(steps)
+    # The (time, kind, value) events read from steps so far
+    self.timeline = []
+    self.schedules = {}
+    # (time, kind, value) events pushed on top of the steps
+    self.pushed = []
+    self.pos = 0
     self.value = 0
 
-    self.trigger = Trigger()
-    self.gate = Gate()
+    self.trigger = Trigger(self)
+    self.gate = Gate(self)
+
+  def _read (self):
+    for event in self.steps:
+      self.timeline.append(event)
+      return True
+    return False
+
+  def _timeline (self):
+    i = 0
+    while i < len(self.timeline) or self._read():
+      yield self.timeline[i]
+      i += 1
+
+  def schedule (self, rate):
+    """
+    The Scheduler for this sequence's events at rate.
+    """
+    if rate not in self.schedules:
+      self.schedules[rate] = Scheduler(rate)
+      self.schedules[rate].add(self._timeline())
+      for event in self.pushed:
+        self.schedules[rate].push(*event)
+    return self.schedules[rate]
+
+  def push (self, time, kind, value=None):
+    """
+    Add an event at time to the steps, at every rate, for block rendering.
+    """
+    self.pushed.append((time, kind, value))
+    for schedule in self.schedules.values():
+      schedule.push(time, kind, value)
 
   def __call__ (self, t):
-    if t > self.until:
-      try:
-        next_value, dur = next(self.steps)
-        print('Sequence:', next_value, dur)
-        self.until = t + dur
-      except StopIteration:
-        next_value = None
-        self.until = -1
-
-      if next_value is None:
-        self.gate.off()
-        # Keep our previous self.value
-      else:
+    return self._step(t, DEFAULT_SAMPLERATE)
+
+  def _step (self, t, rate):
+    """
+    Play the events up to the sample at t, rounding their times to samples
+    as blocks do.
+    """
+    index = self.schedule(rate).index
+    now = index(t)
+    timeline = self.timeline
+    while (not timeline or index(timeline[-1][0]) <= now) and self._read():
+      pass
+
+    while self.pos < len(timeline) and index(timeline[self.pos][0]) <= now:
+      time, kind, value = timeline[self.pos]
+      if kind == ON:
         self.trigger.fire()
         self.gate.on()
-        self.value = next_value
+        self.value = value
+      else:
+        self.gate.off()
+      self.pos += 1
 
     return self.value
 
+  def seek (self, index, rate, block_size=DEFAULT_BLOCKSIZE):
+    self.reset()
+    self.gate.off()
+    if index:
+      self._step(sample_times(index - 1, 1, rate)[0], rate)
+    # Any firing was for a sample already past
+    self.trigger.firing = False
+
+  @stateful
+  def events (self, start, n, rate):
+    """
+    Render a block of this sequence's value along with the trigger and gate
+    it drives, in runs between its events.
+    """
+    schedule = self.schedule(rate)
+    value = 0
+    open = 0
+    for i, event in enumerate(schedule.before(start)):
+      if i == 0:
+        open = int(event.kind == ON)
+      if event.kind == ON:
+        value = event.value
+        break
+
+    values = np.empty(n)
+    trigger = np.zeros(n)
+    gate = np.empty(n)
+    for offset, length, events in schedule.split(start, n):
+      for event in events:
+        if event.kind == ON:
+          value = event.value
+          open = 1
+          trigger[offset] = 1
+        else:
+          open = 0
+      values[offset:offset+length] = value
+      gate[offset:offset+length] = open
+
+    return values, trigger, gate
+
+  def render (self, start, n, rate):
+    return self.events(start, n, rate)[0]
+
 class FrequencySequence (Sequence, FrequencySignal):
   pass
 
 def Synth (steps=[], oscillator=Sine, modifier=None,
            A=0.1, D=0.1, S=0.5, R=0.1):
-  sequencer = FrequencySequence(steps)
+  return Voice(FrequencySequence(steps), oscillator, modifier, A, D, S, R)
+
+def Voice (sequencer, oscillator=Sine, modifier=None,
+           A=0.1, D=0.1, S=0.5, R=0.1, sync=False):
+  """
+  A Synth played by the given sequencer. With sync, its oscillators, those
+  of the modifier included, start each note from the start of their cycles.
+  """
   freq_input = sequencer
   if callable(modifier):
     freq_input = modifier(freq_input)
   oscillator = oscillator(freq_input)
+  nodes = [oscillator] if sync else []
+  while nodes:
+    node = nodes.pop()
+    if isinstance(node, PhasedSignal) and not hasattr(node, 'sync'):
+      node.sync = sequencer.trigger
+    nodes.extend(input for key, input in node.inputs()
+                 if isinstance(input, Signal) and input is not sequencer)
   envelope = ADSREnvelope(A, D, S, R, sequencer.trigger, sequencer.gate)
   return Amp(envelope, oscillator)
 
+class Poly (Signal):
+  """
+  Plays notes, (start, value, dur) in order of start, on a pool of voices
+  made up front by patch(sequencer), by default a synced Voice with the
+  remaining arguments. Each note goes to a voice already released, or else
+  steals one. With steal 'oldest', that is the voice released longest ago,
+  or else the one started longest ago; with 'quietest', the quietest, of
+  those released if any are: the one with the lowest peak over the
+  LEVEL_WINDOW samples before the note. Voices that have gone silent are
+  not rendered.
+
+  The output is the sum of the voices, times gain. Samples asked for one t
+  at a time are taken to be at DEFAULT_SAMPLERATE.
+
+  Which voice a note goes to depends only on the notes before it, for
+  'oldest', so seeking replays them without rendering. How loud a voice is
+  can't be told that way, so a Poly that steals the quietest voice seeks by
+  rendering, which hands out each note at its own sample, so blocks of any
+  size give the same. The voices then seek as if they had never been
+  skipped, which leaves them as rendering would have, so long as their
+  oscillators are synced to their notes, as a Voice's are with sync.
+  """
+  pure = False
+  random_access = False
+
+  def __init__ (self, notes, voices=8, steal='oldest', gain=1, patch=None,
+                **kwargs):
+    if steal not in ('oldest', 'quietest'):
+      raise ValueError('Unknown voice stealing {!r}'.format(steal))
+    if patch is None:
+      kwargs.setdefault('sync', True)
+      patch = lambda sequencer: Voice(sequencer, **kwargs)
+
+    # Kept, so the notes can be scheduled again from any point
+    self.notes = list(note_events(notes))
+    self.steal = steal
+    self.gain = gain
+    self.schedule = None
+    self.voices = []
+    for i in range(voices):
+      sequencer = FrequencySequence()
+      self.voices.append(_Voice(sequencer, patch(sequencer)))
+
+  def _allocate (self, index, value, note):
+    free = [voice for voice in self.voices if voice.note is None]
+    if self.steal == 'quietest':
+      voice = min(free or self.voices, key=lambda voice: voice.level)
+    elif free:
+      # The likeliest to have gone silent by now
+      voice = min(free, key=lambda voice: voice.released)
+    else:
+      voice = min(self.voices, key=lambda voice: voice.started)
+
+    voice.push(self.schedule.rate, index, ON, value)
+    voice.note = note
+    voice.started = index
+    voice.active = True
+
+  def _release (self, index, note):
+    for voice in self.voices:
+      if voice.note == note:
+        voice.push(self.schedule.rate, index, OFF)
+        voice.note = None
+        voice.released = index
+
+  def _schedule (self, rate):
+    if self.schedule is None:
+      self.schedule = Scheduler(rate)
+      self.schedule.add(self.notes)
+    return self.schedule
+
+  def _play (self, start, end, rate):
+    """
+    Hand out the notes that start and end from index start up to end.
+    """
+    for event in self._schedule(rate).span(start, end):
+      if event.kind == ON:
+        self._allocate(event.index, *event.value)
+      else:
+        self._release(event.index, event.value)
+
+  def _mix (self, block, start, rate):
+    n = len(block)
+    for voice in self.voices:
+      if not voice.active:
+        if self.steal == 'quietest':
+          voice.hear(np.zeros(n))
+        continue
+      samps = np.broadcast_to(render_input(voice.output, start, n, rate), n)
+      block += samps
+      if self.steal == 'quietest':
+        voice.hear(samps)
+      if voice.note is None and not samps.any():
+        voice.active = False
+
+  @stateful
+  def render (self, start, n, rate):
+    block = np.zeros(n)
+    if self.steal == 'oldest':
+      self._play(start, start + n, rate)
+      self._mix(block, start, rate)
+    else:
+      # Up to each note first, so the levels it goes by don't depend on where
+      # the blocks begin
+      for offset, length, events in self._schedule(rate).split(start, n):
+        self._play(start + offset, start + offset + length, rate)
+        self._mix(block[offset:offset+length], start + offset, rate)
+    return block * self.gain
+
+  def __call__ (self, t):
+    index = floor(t * DEFAULT_SAMPLERATE + 0.5)
+    return self.render(index, 1, DEFAULT_SAMPLERATE)[0]
+
+  def inputs (self):
+    return ((i, voice.output) for i, voice in enumerate(self.voices))
+
+  def rewire (self, key, input):
+    self.voices[key].output = input
+
+  def snapshot (self):
+    return {
+      'rate': self.schedule.rate if self.schedule else None,
+      'voices': [(voice.note, voice.started, voice.released,
+                  voice.heard.copy(), voice.active, list(voice.events))
+                 for voice in self.voices],
+    }
+
+  def restore (self, state):
+    self.reset()
+    rate = state['rate']
+    for voice, (note, started, released, heard, active, events) in zip(
+        self.voices, state['voices']):
+      for event in events:
+        voice.push(rate, *event)
+      voice.note = note
+      voice.started = started
+      voice.released = released
+      voice.heard = heard.copy()
+      voice.active = active
+
+  def reset (self):
+    super().restore({})
+    self.schedule = None
+    for voice in self.voices:
+      voice.reset()
+
+  def seek (self, index, rate, block_size=DEFAULT_BLOCKSIZE):
+    if self.steal == 'quietest':
+      raise SeekError('Poly cannot seek when stealing the quietest voice')
+    self.reset()
+    self._play(0, index, rate)
+
+class _Voice:
+  def __init__ (self, sequencer, output):
+    self.sequencer = sequencer
+    self.output = output
+    self.reset()
+
+  def reset (self):
+    # The note being held, if any
+    self.note = None
+    self.started = -1
+    self.released = -1
+    # The last LEVEL_WINDOW samples it made
+    self.heard = np.zeros(LEVEL_WINDOW)
+    # Whether it is sounding and so needs rendering
+    self.active = False
+    # The (index, kind, value) events pushed to the sequencer
+    self.events = []
+    self.sequencer.schedules = {}
+    self.sequencer.pushed = []
+
+  def push (self, rate, index, kind, value=None):
+    self.sequencer.push(index / rate, kind, value)
+    self.events.append((index, kind, value))
+
+  def hear (self, samps):
+    n = len(samps)
+    if n >= LEVEL_WINDOW:
+      self.heard = np.array(samps[n-LEVEL_WINDOW:])
+    else:
+      self.heard = np.concatenate((self.heard[n:], samps))
+
+  @property
+  def level (self):
+    """
+    The peak of the last LEVEL_WINDOW samples, as one says little of how
+    loud a voice is.
+    """
+    return np.abs(self.heard).max()
+
 def AMSynth (input, factor=2):
   carrier = Sine(input)
   modulator = Sine(Mult(factor, input))
@@ -508,75 +1377,95 @@ def Vibrato (input, freq=6, cents=50):
   modulator = OldBias(1, Mult(0.0005946*cents, Sine(freq)))
   return Mult(modulator, input)
 
-def Mixer (synths):
-  numSamps = len(synths)
-  def output (t):
-    return sum(synth(t) for synth in synths)/numSamps
+class Mixer (Signal):
+  """
+  The average of synths, each first scaled by its weight if weights are
+  given.
+  """
+  pure = True
 
-  return output
+  def __init__ (self, synths, weights=None):
+    self.synths = list(synths)
+    self.weights = list(weights) if weights is not None else None
 
+  def __call__ (self, t):
+    return self.mix(synth(t) for synth in self.synths)
 
-def Sampler (input, sample_rate, dur=None):
-  sample_dur = 1/sample_rate
-  t = 0
+  def render (self, start, n, rate):
+    return self.mix(render_input(synth, start, n, rate)
+                    for synth in self.synths)
 
-  while True:
-    yield input(t)
+  def mix (self, samples):
+    """
+    Combine one sample, or block, from each synth, in order.
+    """
+    if self.weights is not None:
+      samples = (weight*samp for weight, samp in zip(self.weights, samples))
+    return sum(samples)/len(self.synths)
 
-    t += sample_dur
+  def inputs (self):
+    return enumerate(self.synths)
 
-    if dur and t > dur:
-      break
+  def rewire (self, key, input):
+    self.synths[key] = input
 
-CHANNELS = 1
-DEFAULT_SAMPLERATE = 44100//2
+def Sampler (input, sample_rate=None, dur=None, block_size=None,
+             context=None):
+  """
+  Render input in blocks of block_size samples. The last block may be short.
+  Without a dur, this goes on forever.
 
-def play (input, dur):
-  import alsaaudio
-  from util import chunk
-
-  out = alsaaudio.PCM()
-  out.setchannels(CHANNELS)
-  out.setformat(alsaaudio.PCM_FORMAT_S16_LE)
-  SAMPLERATE = out.setrate(DEFAULT_SAMPLERATE)
-  print(SAMPLERATE)
-  ALSAPERIOD = out.setperiodsize(SAMPLERATE//4)
-
-  total = 0
-  for bs in chunk(Sampler(input, SAMPLERATE, dur), ALSAPERIOD*CHANNELS):
-    wrote = out.write(bs)
-    total += wrote
-    print(wrote, total)
-    if wrote != ALSAPERIOD:
-      print("Huh? Only wrote {}/{}".format(wrote, ALSAPERIOD))
+  The rate, block size and sample type come from context, by default
+  default_context(), where sample_rate and block_size don't override them.
+  """
+  context = context or default_context()
+  sample_rate = sample_rate or context.rate
+  block_size = block_size or context.block_size
+  total = int(dur*sample_rate) + 1 if dur else None
+  start = 0
+
+  while total is None or start < total:
+    n = block_size if total is None else min(block_size, total - start)
+    yield np.broadcast_to(render_input(input, start, n, sample_rate),
+                          n).astype(context.dtype, copy=False)
+    start += n
+
+def play (input, dur, latency=0.5, context=None):
+  """
+  Play input through ALSA, rendering up to latency seconds ahead. Returns the
+  playback metrics, underruns and all.
+  """
+  from playback import Engine, AlsaSink
+
+  context = context or default_context()
+  sink = AlsaSink(context.rate, context.channels, context.rate//4)
+  print(sink.rate)
+  engine = Engine(Sampler(input, sink.rate, dur, sink.period, context), sink,
+                  sink.rate, context.channels, latency, sink.period)
+  metrics = engine.run()
+  if metrics['underruns']:
+    print("Underran {underruns} times, {underrun_frames} frames"
+          .format(**metrics))
 
   print('Closing...')
-  out.close()
-
-def write (input, dur, filename='out.wav'):
-  print(DEFAULT_SAMPLERATE)
-  import wave, array
-  from util import byte_array
-
-  bytes = byte_array(Sampler(input, DEFAULT_SAMPLERATE, dur))
-  #bytes = array.array('f', Sampler(input, DEFAULT_SAMPLERATE*2, dur))
+  return metrics
 
-  #f = wave.open(filename, 'w')
-  #f.setnchannels(CHANNELS)
-  #f.setsampwidth(2)
-  #f.setframerate(DEFAULT_SAMPLERATE)
-  #f.setcomptype('NONE', 'not compressed')
-  #f.setnframes(len(bytes))
-  #f.writeframesraw(bytes)
-  #print(f._datawritten, f._nframeswritten)
-  #f.close()
+def write (input, dur, filename='out.wav', format='int16', context=None):
+  """
+  Render dur seconds of input to filename a block at a time, as WAV, AIFF
+  or raw samples by its extension, in format 'int16', 'int24' or 'float32'.
+  """
+  context = context or default_context()
+  print(context.rate)
+  from writers import open_writer
 
-  with open(filename + '.raw', 'wb') as rf:
-    rf.write(bytes)
+  with open_writer(filename, format=format, context=context) as writer:
+    for block in Sampler(input, dur=dur, context=context):
+      writer.write(block)
 
-def generate (input, dur):
-  """ For profiling. """
-  return list(Sampler(input, DEFAULT_SAMPLERATE, dur))
+def generate (input, dur, context=None):
+  """ For profiling. instrument.profile() breaks the time down by node. """
+  return np.concatenate(list(Sampler(input, dur=dur, context=context)))
 
 def random_walk ():
   import random
@@ -629,9 +1518,8 @@ if __name__ == '__main__':
     #steps=iter([next(rw) for x in range(40)] + [(None, 0.5)]))
   #write(synth, 10.5)
 
-  #import guitar_wave
-  #class Guitar (PhasedSignal):
-    #_phase = guitar_wave.data
+  #from recording import load, SingleCycle
+  #Guitar = SingleCycle(load('guitar.wav'))
 
   #from music import PianoRoll
   #import tabreader
@@ -0,0 +1,298 @@
+"""
+IIR filters that process whole blocks, carrying their state from one block
+to the next: one-pole and biquad lowpass, highpass, bandpass and notch
+filters, and cascades of them. They filter sounds generators as
+sounds.Filters do, and device.py graphs through Filtered.
+
+scipy's lfilter runs them when it is installed. Without it, each section is
+split into two first order recursions, which are solved a block at a time
+with cumulative sums.
+"""
+from cmath import log
+from copy import deepcopy
+from functools import lru_cache
+from math import cos, sin, pi, log10
+import numpy as np
+import sounds
+from device import Signal, Input, render_input, stateful, DEFAULT_SAMPLERATE
+
+try:
+  from scipy.signal import lfilter, lfiltic
+except ImportError:
+  lfilter = None
+
+# Samples between updates of the coefficients while a parameter glides
+CONTROL_PERIOD = 32
+
+def _design (kind, freq, Q, rate):
+  """
+  Biquad coefficients (b0, b1, b2, a1, a2), normalized to a0 = 1, from
+  the Audio EQ Cookbook.
+  """
+  w = 2*pi * min(freq, 0.499*rate) / rate
+  alpha = sin(w) / (2*Q)
+  c = cos(w)
+  if kind == 'lowpass':
+    b = ((1 - c)/2, 1 - c, (1 - c)/2)
+  elif kind == 'highpass':
+    b = ((1 + c)/2, -(1 + c), (1 + c)/2)
+  elif kind == 'bandpass':
+    # Constant 0 dB peak gain
+    b = (alpha, 0, -alpha)
+  elif kind == 'notch':
+    b = (1, -2*c, 1)
+  else:
+    raise ValueError('Unknown filter kind {!r}'.format(kind))
+  a0 = 1 + alpha
+  return (b[0]/a0, b[1]/a0, b[2]/a0, -2*c/a0, (1 - alpha)/a0)
+
+def _design_one_pole (kind, freq, rate):
+  p = np.exp(-2*pi * min(freq, 0.499*rate) / rate)
+  if kind == 'lowpass':
+    return (1 - p, 0, 0, -p, 0)
+  if kind == 'highpass':
+    return ((1 + p)/2, -(1 + p)/2, 0, -p, 0)
+  raise ValueError('Unknown one-pole filter kind {!r}'.format(kind))
+
+@lru_cache(maxsize=1024)
+def _powers (p, size):
+  """
+  p**k for k in range(size), and their inverses, for _recurse.
+  """
+  k = np.arange(size) * log(p)
+  return np.exp(k), np.exp(-k)
+
+def _recurse (x, p, v):
+  """
+  The first order recursion out[n] = p*out[n-1] + x[n], from out[-1] = v.
+
+  Within chunks short enough that p**-len can't overflow, it's
+  p**n * cumsum(x[m] * p**-m). The chunks are then strung together by
+  carrying each one's last value into the next.
+  """
+  n = len(x)
+  if abs(p) < 1e-12:
+    return x.astype(complex)
+  size = n
+  if abs(p) < 1 and n * -log10(abs(p)) > 100:
+    size = max(1, int(100 / -log10(abs(p))))
+  chunks = -(-n // size)
+  X = np.zeros(chunks * size, complex)
+  X[:n] = x
+  X = X.reshape(chunks, size)
+  powers, inverse = _powers(p, size)
+  out = powers * np.cumsum(X * inverse, axis=1)
+
+  # The value each chunk starts from, carried through the chunks before it
+  carry = np.empty(chunks, complex)
+  step = p ** size
+  for i, last in enumerate(out[:, -1]):
+    carry[i] = v
+    v = last + step*v
+  out += np.outer(carry, powers * p)
+  return out.ravel()[:n]
+
+def _biquad (coefficients, x, history):
+  """
+  Filter x through one section, from history: the last two inputs and
+  outputs, latest first. Returns the output and the new history.
+  """
+  b0, b1, b2, a1, a2 = coefficients
+  x1, x2, y1, y2 = history
+  if lfilter is not None:
+    b = (b0, b1, b2)
+    a = (1, a1, a2)
+    y, _ = lfilter(b, a, x, zi=lfiltic(b, a, (y1, y2), (x1, x2)))
+  else:
+    # The numerator as a short FIR, then the denominator factored into two
+    # poles, with the state each starts from worked back from the history
+    padded = np.concatenate(((x2, x1), x))
+    u = b0*padded[2:] + b1*padded[1:-1] + b2*padded[:-2]
+    root = np.sqrt(complex(a1*a1 - 4*a2))
+    p1 = (-a1 + root) / 2
+    p2 = (-a1 - root) / 2
+    w = _recurse(u, p1, y1 - p2*y2)
+    y = _recurse(w, p2, y1).real
+
+  if len(x) >= 2:
+    history = (x[-1], x[-2], y[-1], y[-2])
+  else:
+    history = (x[-1], x1, y[-1], y1)
+  return y, history
+
+class Biquad (sounds.Filter):
+  """
+  A second order section: kind is 'lowpass', 'highpass', 'bandpass' or
+  'notch', at freq Hz with resonance Q.
+
+  set() changes the parameters. They glide to their new values with a time
+  constant of smoothing seconds, the coefficients following every
+  CONTROL_PERIOD samples of the stream, so that sweeps don't click, and come
+  out the same however the stream is cut into blocks.
+  """
+
+  def __init__ (self, kind='lowpass', freq=1000, Q=1/np.sqrt(2),
+                smoothing=0.005):
+    self.kind = kind
+    self.smoothing = smoothing
+    self.target = (freq, Q)
+    self.params = self.target
+    self.reset()
+
+  def coefficients (self, freq, Q, rate):
+    return _design(self.kind, freq, Q, rate)
+
+  def set (self, freq=None, Q=None):
+    self.target = (self.target[0] if freq is None else freq,
+                   self.target[1] if Q is None else Q)
+
+  def reset (self):
+    self.history = (0, 0, 0, 0)
+    self.params = self.target
+    # Samples since the last control point
+    self.phase = 0
+    self._cached = None
+
+  def snapshot (self):
+    return {'history': self.history, 'params': self.params,
+            'target': self.target, 'phase': self.phase}
+
+  def restore (self, state):
+    vars(self).update(state)
+    self._cached = None
+
+  def _coefficients (self, rate):
+    key = (self.params, rate)
+    if self._cached is None or self._cached[0] != key:
+      self._cached = (key, self.coefficients(*self.params, rate))
+    return self._cached[1]
+
+  def process (self, block, rate=None, freq=None, Q=None):
+    """
+    Filter a block. freq and Q, if given, are new targets: constants, or
+    arrays with one for each sample of the block, which are read every
+    CONTROL_PERIOD samples.
+    """
+    rate = rate or sounds.default_context().rate
+    block = np.asarray(block, dtype=float)
+    n = len(block)
+    if not n:
+      return block
+    if np.ndim(freq) == 0 and np.ndim(Q) == 0:
+      self.set(freq, Q)
+      if self.params == self.target:
+        y, self.history = _biquad(self._coefficients(rate), block,
+                                  self.history)
+        self.phase = (self.phase + n) % CONTROL_PERIOD
+        return y
+
+    out = np.empty(n)
+    pole = np.exp(-CONTROL_PERIOD / (self.smoothing * rate)
+                  if self.smoothing else -np.inf)
+    start = 0
+    while start < n:
+      if not self.phase:
+        self.set(freq[start] if np.ndim(freq) else freq,
+                 Q[start] if np.ndim(Q) else Q)
+        # Glide the parameters, and land on the target once close enough
+        params = tuple(t + (p - t)*pole
+                       for p, t in zip(self.params, self.target))
+        close = all(abs(p - t) <= 1e-4*abs(t)
+                    for p, t in zip(params, self.target))
+        self.params = self.target if close else params
+      end = min(n, start + CONTROL_PERIOD - self.phase)
+      out[start:end], self.history = _biquad(self._coefficients(rate),
+                                             block[start:end], self.history)
+      self.phase = (self.phase + end - start) % CONTROL_PERIOD
+      start = end
+    return out
+
+class OnePole (Biquad):
+  """
+  A first order 'lowpass' or 'highpass' filter, with a gentle 6 dB/octave
+  slope and no resonance.
+  """
+
+  def __init__ (self, kind='lowpass', freq=1000, smoothing=0.005):
+    super().__init__(kind, freq, 1, smoothing)
+
+  def coefficients (self, freq, Q, rate):
+    return _design_one_pole(self.kind, freq, rate)
+
+class Cascade (sounds.Filter):
+  """
+  Sections in series, such as two lowpass Biquads for a 24 dB/octave slope.
+  set() and the targets process() takes go to every section.
+  """
+
+  def __init__ (self, *sections):
+    self.sections = list(sections)
+
+  def set (self, freq=None, Q=None):
+    for section in self.sections:
+      section.set(freq, Q)
+
+  def reset (self):
+    for section in self.sections:
+      section.reset()
+
+  def snapshot (self):
+    return {'sections': [section.snapshot() for section in self.sections]}
+
+  def restore (self, state):
+    for section, state in zip(self.sections, state['sections']):
+      section.restore(state)
+
+  def process (self, block, rate=None, freq=None, Q=None):
+    for section in self.sections:
+      block = section.process(block, rate, freq, Q)
+    return block
+
+class Filtered (Signal):
+  """
+  A device.py node running input through filter, a Biquad, OnePole or
+  Cascade. freq and Q, if given, are inputs that move the filter's.
+
+  Samples asked for one t at a time are taken to be at DEFAULT_SAMPLERATE.
+  """
+  random_access = False
+  input = Input()
+  freq = Input()
+  Q = Input()
+
+  def __init__ (self, input, filter, freq=None, Q=None):
+    self.input = input
+    self.filter = filter
+    if freq is not None:
+      self.freq = freq
+    if Q is not None:
+      self.Q = Q
+
+  def _param (self, name, start, n, rate):
+    if not hasattr(self, name):
+      return None
+    return render_input(getattr(self, name), start, n, rate)
+
+  def __call__ (self, t):
+    freq = self._call_freq(t) if hasattr(self, '_freq') else None
+    Q = self._call_Q(t) if hasattr(self, '_Q') else None
+    return float(self.filter.process([self._call_input(t)],
+                                     DEFAULT_SAMPLERATE, freq, Q)[0])
+
+  @stateful
+  def render (self, start, n, rate):
+    x = np.broadcast_to(self._input.render(start, n, rate), n)
+    return self.filter.process(x, rate, self._param('_freq', start, n, rate),
+                               self._param('_Q', start, n, rate))
+
+  def snapshot (self):
+    return {'filter': deepcopy(self.filter.snapshot())}
+
+  def restore (self, state):
+    super().restore({})
+    if 'filter' in state:
+      self.filter.restore(deepcopy(state['filter']))
+
+  def reset (self):
+    super().restore({})
+    self.filter.reset()
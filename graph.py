@@ -0,0 +1,347 @@
+"""
+Passes over device.py Signal graphs, run once when a patch is built.
+"""
+from math import floor
+from device import (Signal, Const, Input, PhasedSignal, SeekError,
+                    render_input, stateful, _random_access)
+import numpy as np
+
+class Shared (Signal):
+  """
+  Evaluates its input once per t or block, however many consumers read it.
+  Anything else they read of it, such as a Sequence's events, is the
+  input's.
+  """
+  _initial = {'last_t': None, 'last_samp': None}
+  input = Input()
+
+  def __init__ (self, input):
+    self.input = input
+    self.last_t = None
+    self.last_samp = None
+
+  def __call__ (self, t):
+    if t != self.last_t:
+      self.last_t = t
+      self.last_samp = self._call_input(t)
+    return self.last_samp
+
+  @stateful
+  def render (self, start, n, rate):
+    return self._input.render(start, n, rate)
+
+  def __getattr__ (self, name):
+    if name.startswith('_'):
+      raise AttributeError(name)
+    return getattr(self._input, name)
+
+class ControlRate (Signal):
+  """
+  Evaluates its input at control rate, once every period samples, and
+  fills in the samples between by linear interpolation, or by holding each
+  value when interpolate is false. Sampled one t at a time, it passes its
+  input straight through.
+
+  Each block renders the input from where the last left off up to the
+  control point at or after the block's end, so a stateful input is still
+  rendered in order.
+  """
+  input = Input()
+  _initial = {'base': 0, 'next': None, 'points': None}
+
+  def __init__ (self, input, period=32, interpolate=True):
+    self.input = input
+    self.period = period
+    self.interpolate = interpolate
+    self.reset()
+
+  @property
+  def random_access (self):
+    return _random_access(self._input)
+
+  def __call__ (self, t):
+    return self._call_input(t)
+
+  @stateful
+  def render (self, start, n, rate):
+    period = self.period
+    first = start // period
+    last = (start + n - 1) // period + (1 if self.interpolate else 0)
+    if self.next is None or not self.base <= first <= self.next:
+      # Starting afresh, or after a gap
+      self.base = self.next = first
+      self.points = np.empty(0)
+
+    points = self.points[first - self.base:]
+    if last >= self.next:
+      count = last + 1 - self.next
+      new = np.broadcast_to(render_input(self._input, self.next, count,
+                                         rate / period), count)
+      points = np.concatenate((points, new))
+      self.next = last + 1
+    self.base = first
+    self.points = points
+
+    i = np.arange(start, start + n)
+    if not self.interpolate:
+      return points[i // period - first]
+    return np.interp(i / period - first, np.arange(len(points)), points)
+
+def walk (output):
+  """
+  Every Signal reachable from output, once each, consumers before the inputs
+  they read.
+  """
+  order = []
+  seen = set()
+  stack = [(output, False)]
+  while stack:
+    node, done = stack.pop()
+    if done:
+      order.append(node)
+      continue
+    if id(node) in seen:
+      continue
+    seen.add(id(node))
+    stack.append((node, True))
+    for key, input in node.inputs():
+      if isinstance(input, Signal) and id(input) not in seen:
+        stack.append((input, False))
+
+  order.reverse()
+  return order
+
+def consumers (output):
+  """
+  Map the id of every node reachable from output to the (consumer, key) pairs
+  that read it.
+  """
+  readers = {id(output): []}
+  for node in walk(output):
+    for key, input in node.inputs():
+      if isinstance(input, Signal):
+        readers.setdefault(id(input), []).append((node, key))
+  return readers
+
+def evaluations (output):
+  """
+  How many node evaluations each sample (or block) of output costs, counting
+  a node once for every path that reaches it. A Shared node's input is only
+  counted once, and a ControlRate's once per period.
+  """
+  counts = {id(output): 1}
+  total = 0
+  for node in walk(output):
+    evals = counts[id(node)]
+    if isinstance(node, Shared):
+      evals = 1
+    else:
+      total += evals
+    if isinstance(node, ControlRate):
+      evals /= node.period
+
+    for key, input in node.inputs():
+      if isinstance(input, Signal):
+        counts[id(input)] = counts.get(id(input), 0) + evals
+  return total
+
+class Plan:
+  """
+  The result of compiling a graph: its output, the nodes folded into
+  constants, the nodes put at control rate, the nodes found to be shared,
+  and the evaluations per sample before and after.
+  """
+  def __init__ (self, output, folded, shared, evals_before, evals_after,
+                controlled=()):
+    self.output = output
+    self.folded = folded
+    self.shared = shared
+    self.evals_before = evals_before
+    self.evals_after = evals_after
+    self.controlled = list(controlled)
+
+  @property
+  def removed (self):
+    return self.evals_before - self.evals_after
+
+  def __str__ (self):
+    return ("{} folded nodes, {} control rate nodes, {} shared nodes; {} "
+            "evaluations per sample before, {} after ({} removed)".format(
+              len(self.folded), len(self.controlled), len(self.shared),
+              self.evals_before, self.evals_after, self.removed))
+
+def _constant (input):
+  """
+  Whether input is a constant: a plain number, or a node that renders as
+  Const does. (A Mult of two constants subclasses Const, but computes.)
+  """
+  if not callable(input):
+    return True
+  return isinstance(input, Signal) and type(input).render is Const.render
+
+def _value (input):
+  return input.val if callable(input) else input
+
+def _accepts_numbers (node, key):
+  """
+  Whether node reads its input at key with plain numbers allowed in place of
+  a Const, as PhasedSignal's freq does.
+  """
+  for cls in type(node).__mro__:
+    for var in vars(cls).values():
+      if isinstance(var, Input) and var.varname == key:
+        return var.const_type is None
+  return False
+
+def fold (output):
+  """
+  Replace every pure node whose inputs are all constant with a Const of its
+  value, computed once here rather than per sample. Where an input allows
+  it, the Const is dropped for the bare number. Returns the new output and
+  the folded nodes.
+  """
+  folded = []
+  values = {}
+
+  def foldable (node):
+    if id(node) in values:
+      return True
+    if not (isinstance(node, Signal) and node.pure) or _constant(node):
+      return False
+
+    inputs = list(node.inputs())
+    if not inputs or not all(_constant(input) for key, input in inputs):
+      return False
+
+    values[id(node)] = node(0)
+    folded.append(node)
+    return True
+
+  # Inputs first, so each node sees its inputs already folded
+  for node in reversed(walk(output)):
+    for key, input in list(node.inputs()):
+      if foldable(input):
+        value = values[id(input)]
+        node.rewire(key, value if _accepts_numbers(node, key) else
+                    Const(value))
+
+  if foldable(output):
+    output = Const(values[id(output)])
+
+  return output, folded
+
+def control (output, period=32, interpolate=True, lfo=20):
+  """
+  Put the slowly varying parts of the graph behind output at control rate,
+  each evaluated once every period samples by a ControlRate node in front
+  of it. Slow nodes are those marked control, such as envelopes and ramps,
+  oscillators at a constant frequency of at most lfo Hz, and pure nodes
+  reading only slow nodes and constants. Only the slow nodes that audio
+  rate nodes read are wrapped; the rest run at control rate within them.
+  Returns the wrapped nodes.
+  """
+  slow = set()
+
+  def is_slow (input):
+    return id(input) in slow or _constant(input)
+
+  # Inputs first, so each node sees whether its inputs are slow
+  for node in reversed(walk(output)):
+    inputs = [input for key, input in node.inputs()]
+    if node.control:
+      slow.add(id(node))
+    elif node.pure:
+      if inputs and all(map(is_slow, inputs)):
+        slow.add(id(node))
+    elif isinstance(node, PhasedSignal):
+      freq = node._freq
+      if _constant(freq) and abs(_value(freq)) <= lfo:
+        slow.add(id(node))
+
+  controlled = []
+  readers = consumers(output)
+  for node in walk(output):
+    if id(node) not in slow:
+      continue
+    fast = [(consumer, key) for consumer, key in readers[id(node)]
+            if id(consumer) not in slow]
+    if not fast:
+      continue
+
+    wrapper = ControlRate(node, period, interpolate)
+    for consumer, key in fast:
+      consumer.rewire(key, wrapper)
+    controlled.append(node)
+
+  return controlled
+
+def share (output):
+  """
+  Put a Shared node in front of each node read by more than one consumer and
+  point the consumers at it. Returns the (node, consumer count) pairs.
+  """
+  shared = []
+  readers = consumers(output)
+  for node in walk(output):
+    reads = readers[id(node)]
+    if len(reads) < 2 or isinstance(node, Shared):
+      continue
+
+    cache = Shared(node)
+    for consumer, key in reads:
+      consumer.rewire(key, cache)
+    shared.append((node, len(reads)))
+
+  return shared
+
+def compile (output, control_period=None):
+  """
+  Rewrite the graph behind output so that constant arithmetic is done once,
+  up front, and each node is evaluated once per sample or block. With a
+  control_period, slowly varying nodes are also put at control rate (see
+  control()). Returns the Plan, whose output replaces the one given.
+  """
+  evals_before = evaluations(output)
+  output, folded = fold(output)
+  controlled = control(output, control_period) if control_period else []
+  shared = share(output)
+  return Plan(output, folded, shared, evals_before, evaluations(output),
+              controlled)
+
+def snapshot (output):
+  """
+  The state of every node behind output, as plain data that can be pickled.
+  restore() takes it back into the same graph, or one built the same way.
+  """
+  return [node.snapshot() for node in walk(output)]
+
+def restore (output, states):
+  nodes = walk(output)
+  if len(nodes) != len(states):
+    raise ValueError('A snapshot of {} nodes does not fit a graph of {}'
+                     .format(len(states), len(nodes)))
+  for node, state in zip(nodes, states):
+    node.restore(state)
+
+def seek (output, t, rate, block_size=1 << 16):
+  """
+  Put the graph behind output in the state it would have after rendering up
+  to time t, and return the sample index to render on from. Catching up is
+  done in blocks of block_size samples.
+
+  Where every node can seek on its own, this costs about what rendering the
+  stateful nodes by themselves does, and often far less. Otherwise the whole
+  graph is reset and rendered up to t.
+  """
+  index = floor(t*rate + 0.5)
+  # Consumers first, so a Poly hands out its notes before its voices seek
+  nodes = walk(output)
+  try:
+    for node in nodes:
+      node.seek(index, rate, block_size)
+  except SeekError:
+    for node in nodes:
+      node.reset()
+    for start in range(0, index, block_size):
+      render_input(output, start, min(block_size, index - start), rate)
+  return index
@@ -0,0 +1,170 @@
+"""
+Per-node profiling of device.py Signal graphs. Profiling a graph rewires
+every node's consumers through a Probe that times it, and remove() puts the
+graph back as it was, so a graph that isn't being profiled pays nothing.
+"""
+from time import perf_counter
+from device import Signal, Sampler, DEFAULT_SAMPLERATE, DEFAULT_BLOCKSIZE
+from graph import walk
+
+class Stats:
+  """
+  What a Probe found out about its node. Self time leaves out the time spent
+  in the probed nodes it reads.
+  """
+  def __init__ (self, name):
+    self.name = name
+    self.calls = 0
+    self.samples = 0
+    self.cumulative = 0
+    self.self_time = 0
+
+  @property
+  def rate (self):
+    """
+    Samples rendered per second of the node's own time.
+    """
+    return self.samples / self.self_time if self.self_time else None
+
+class Probe (Signal):
+  """
+  Stands in for node, timing every block or sample asked of it. Anything
+  else its consumers read of it, such as a Sequence's events, is the node's.
+  """
+
+  def __init__ (self, node, profile, stats):
+    self.node = node
+    self.profile = profile
+    self.stats = stats
+
+  def _time (self, samples, fn, *args):
+    profile = self.profile
+    profile.stack.append(self.stats.name)
+    profile.children.append(0)
+    start = perf_counter()
+    try:
+      return fn(*args)
+    finally:
+      elapsed = perf_counter() - start
+      own = elapsed - profile.children.pop()
+      stack = ';'.join(profile.stack)
+      profile.stack.pop()
+      if profile.children:
+        profile.children[-1] += elapsed
+
+      stats = self.stats
+      stats.calls += 1
+      stats.samples += samples
+      stats.cumulative += elapsed
+      stats.self_time += own
+      profile.stacks[stack] = profile.stacks.get(stack, 0) + own
+
+  def __call__ (self, t):
+    return self._time(1, self.node, t)
+
+  def render (self, start, n, rate):
+    return self._time(n, self.node.render, start, n, rate)
+
+  def inputs (self):
+    yield 'node', self.node
+
+  def __getattr__ (self, name):
+    if name.startswith('_'):
+      raise AttributeError(name)
+    return getattr(self.node, name)
+
+class Profile:
+  """
+  The probes put into the graph behind output, and what they record. Use
+  output in place of the one given while profiling.
+  """
+
+  def __init__ (self, output):
+    self.stats = []
+    self.stack = []
+    self.children = []
+    # Self time by the semicolon separated path of nodes it was spent under
+    self.stacks = {}
+    self.render_time = 0
+    self.rendered = 0
+
+    self.probes = {}
+    self.wired = []
+    for node in walk(output):
+      for key, input in list(node.inputs()):
+        if isinstance(input, Signal):
+          node.rewire(key, self._probe(input))
+          self.wired.append((node, key, input))
+    self.output = self._probe(output)
+
+  def _probe (self, node):
+    if id(node) not in self.probes:
+      name = '{}#{}'.format(type(node).__name__, len(self.stats))
+      self.stats.append(Stats(name))
+      self.probes[id(node)] = Probe(node, self, self.stats[-1])
+    return self.probes[id(node)]
+
+  def remove (self):
+    """
+    Wire the graph back up as it was before profiling.
+    """
+    for node, key, input in reversed(self.wired):
+      node.rewire(key, input)
+    self.wired = []
+
+  def run (self, dur, rate=DEFAULT_SAMPLERATE, block_size=DEFAULT_BLOCKSIZE):
+    """
+    Render dur seconds of the output, timing the whole as well as its parts.
+    """
+    start = perf_counter()
+    for block in Sampler(self.output, rate, dur, block_size):
+      self.rendered += len(block) / rate
+    self.render_time += perf_counter() - start
+    return self
+
+  @property
+  def realtime_factor (self):
+    """
+    Seconds of audio rendered per second spent rendering it.
+    """
+    return self.rendered / self.render_time if self.render_time else None
+
+  def table (self, sort='self_time'):
+    """
+    The stats of every node as a text table, the costliest first.
+    """
+    total = sum(stats.self_time for stats in self.stats) or 1
+    lines = ['{:<24} {:>8} {:>10} {:>10} {:>10} {:>6} {:>12}'.format(
+      'node', 'calls', 'samples', 'cum (s)', 'self (s)', 'self%',
+      'samples/s')]
+    for stats in sorted(self.stats, key=lambda stats: getattr(stats, sort),
+                        reverse=True):
+      lines.append('{:<24} {:>8} {:>10} {:>10.4f} {:>10.4f} {:>6.1%} {:>12}'
+                   .format(stats.name, stats.calls, stats.samples,
+                           stats.cumulative, stats.self_time,
+                           stats.self_time / total,
+                           '{:.0f}'.format(stats.rate) if stats.rate else '-'))
+    if self.render_time:
+      lines.append('Rendered {:.2f}s in {:.2f}s, {:.1f}x realtime'.format(
+        self.rendered, self.render_time, self.realtime_factor))
+    return '\n'.join(lines)
+
+  def folded (self):
+    """
+    Self time per stack in microseconds, one 'a;b;c count' line each, as
+    flame graph tools read.
+    """
+    return ''.join('{} {}\n'.format(stack, round(time * 1e6))
+                   for stack, time in sorted(self.stacks.items()))
+
+def profile (output, dur, rate=DEFAULT_SAMPLERATE,
+             block_size=DEFAULT_BLOCKSIZE):
+  """
+  Profile rendering dur seconds of output, leaving the graph as it was.
+  """
+  prof = Profile(output)
+  try:
+    prof.run(dur, rate, block_size)
+  finally:
+    prof.remove()
+  return prof
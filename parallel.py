@@ -0,0 +1,131 @@
+"""
+Rendering the voices of a Mixer in worker processes.
+"""
+import multiprocessing
+import numpy as np
+import os
+import weakref
+from multiprocessing.shared_memory import SharedMemory
+from device import (Mixer, SeekError, DEFAULT_BLOCKSIZE, render_input,
+                    stateful)
+
+def _work (synths, voices, shm_name, shape, conn):
+  shm = SharedMemory(name=shm_name)
+  out = np.ndarray(shape, buffer=shm.buf)
+  try:
+    while True:
+      block = conn.recv()
+      if block is None:
+        break
+      start, n, rate = block
+      for i in voices:
+        out[i, :n] = render_input(synths[i], start, n, rate)
+      conn.send(n)
+  finally:
+    del out
+    shm.close()
+
+def _stop (workers, shm):
+  try:
+    for proc, conn in workers:
+      try:
+        conn.send(None)
+      except OSError:
+        # It has already exited, on an error in its voices
+        pass
+    for proc, conn in workers:
+      proc.join()
+  finally:
+    shm.unlink()
+    shm.close()
+
+class ParallelMixer (Mixer):
+  """
+  A Mixer whose synths are rendered by worker processes, each owning a group
+  of voices for the whole render. Workers hand back every voice's block
+  through shared memory, and they are summed here in the same order as
+  Mixer sums them, so the output is bit for bit the same.
+
+  The workers are forked, with their own copies of the graph, when it is
+  made: from the thread that made it, rather than one that renders, which
+  may be a playback engine's. So make it last, once the synths are done
+  with. From then on their state lives in the workers, so blocks must be
+  asked for in order, and not sample by sample.
+
+  The workers are stopped, and the shared memory freed, by close(), or
+  failing that once it is garbage.
+  """
+  # Unlike a Mixer's, its output depends on the state in the workers
+  pure = False
+  random_access = False
+
+  def __init__ (self, synths, weights=None, processes=None,
+                block_size=DEFAULT_BLOCKSIZE):
+    super().__init__(synths, weights)
+    self.processes = min(processes or os.cpu_count(), len(self.synths))
+    self.block_size = block_size
+    self.workers = None
+    self._start()
+
+  def _start (self):
+    ctx = multiprocessing.get_context('fork')
+    shape = self.shape = (len(self.synths), self.block_size)
+    self.shm = SharedMemory(create=True, size=8*shape[0]*shape[1])
+    self.workers = []
+    for voices in np.array_split(range(len(self.synths)), self.processes):
+      conn, child = ctx.Pipe()
+      proc = ctx.Process(target=_work, daemon=True,
+                         args=(self.synths, list(voices), self.shm.name, shape,
+                               child))
+      proc.start()
+      self.workers.append((proc, conn))
+    # Holds no reference to self, or it would never be garbage
+    self._stop = weakref.finalize(self, _stop, self.workers, self.shm)
+
+  @stateful
+  def render (self, start, n, rate):
+    if self.workers is None:
+      raise ValueError('Rendering a closed ParallelMixer')
+
+    block = np.empty(n)
+    # A view made for each block, so none is left to keep the memory open
+    out = np.ndarray(self.shape, buffer=self.shm.buf)
+    try:
+      for i in range(0, n, self.block_size):
+        m = min(self.block_size, n - i)
+        for proc, conn in self.workers:
+          conn.send((start + i, m, rate))
+        for proc, conn in self.workers:
+          conn.recv()
+        block[i:i+m] = self.mix(out[v, :m] for v in range(len(self.synths)))
+    except BaseException:
+      # A worker has died, or we were interrupted: stop the rest
+      del out
+      self.close()
+      raise
+    return block
+
+  def snapshot (self):
+    if self.workers is not None:
+      raise SeekError('The state of a running ParallelMixer is in its workers')
+    return super().snapshot()
+
+  def restore (self, state):
+    if self.workers is not None:
+      raise SeekError('The state of a running ParallelMixer is in its workers')
+    super().restore(state)
+
+  def close (self):
+    """
+    Stop the workers and free the shared memory.
+    """
+    if self.workers is None:
+      return
+    self.workers = None
+    self._stop()
+
+  def __enter__ (self):
+    return self
+
+  def __exit__ (self, *exc):
+    self.close()
@@ -0,0 +1,332 @@
+"""
+Real-time playback: a producer thread renders ahead into a ring buffer, and
+the audio backend drains it from its own callback.
+"""
+import threading
+import numpy as np
+from time import perf_counter, sleep
+from util import PCMEncoder
+
+class RingBuffer:
+  """
+  A bounded FIFO of frames between one writer, which waits for room, and one
+  reader, which never waits.
+  """
+
+  def __init__ (self, capacity, channels=1):
+    self.capacity = capacity
+    self.frames = np.zeros((capacity, channels), dtype=np.float32)
+    # Running totals of frames written and read
+    self.head = 0
+    self.tail = 0
+    self.closed = False
+    self.cond = threading.Condition()
+
+  def __len__ (self):
+    return self.head - self.tail
+
+  def write (self, block):
+    """
+    Append block, waiting for the reader to make room as needed. Returns False
+    if the buffer was closed before all of it went in.
+    """
+    block = np.asarray(block).reshape(len(block), -1)
+    i = 0
+    while i < len(block):
+      with self.cond:
+        while len(self) == self.capacity and not self.closed:
+          self.cond.wait()
+        if self.closed:
+          return False
+
+        n = min(len(block) - i, self.capacity - len(self))
+        pos = self.head % self.capacity
+        first = min(n, self.capacity - pos)
+        self.frames[pos:pos+first] = block[i:i+first]
+        self.frames[:n-first] = block[i+first:i+n]
+        self.head += n
+        self.cond.notify_all()
+      i += n
+    return True
+
+  def read (self, n):
+    """
+    Take up to n frames, as many as there are.
+    """
+    with self.cond:
+      n = min(n, len(self))
+      pos = self.tail % self.capacity
+      first = min(n, self.capacity - pos)
+      frames = np.concatenate((self.frames[pos:pos+first],
+                               self.frames[:n-first]))
+      self.tail += n
+      self.cond.notify_all()
+    return frames
+
+  def close (self):
+    with self.cond:
+      self.closed = True
+      self.cond.notify_all()
+
+class Engine:
+  """
+  Plays blocks from source, an iterable of sample arrays such as
+  device.Sampler gives, through sink.
+
+  latency: Seconds of audio rendered ahead, which sets the buffer depth.
+  period: Frames the sink takes at a time.
+  """
+
+  def __init__ (self, source, sink, rate, channels=1, latency=0.25,
+                period=1024):
+    self.source = source
+    self.sink = sink
+    self.rate = rate
+    self.channels = channels
+    self.period = period
+    self.buffer = RingBuffer(max(int(latency*rate), period), channels)
+
+    self.underruns = 0
+    self.underrun_frames = 0
+    self.frames_rendered = 0
+    self.frames_played = 0
+    self.render_time = 0
+
+    self.exhausted = threading.Event()
+    self.finished = threading.Event()
+    self.producer = None
+    # What the source raised, if it did, for run() to raise in turn
+    self.error = None
+
+  def _produce (self):
+    source = iter(self.source)
+    try:
+      while True:
+        start = perf_counter()
+        try:
+          block = next(source)
+        except StopIteration:
+          break
+        self.render_time += perf_counter() - start
+
+        if not self.buffer.write(block):
+          break
+        self.frames_rendered += len(block)
+    except Exception as e:
+      self.error = e
+    finally:
+      with self.buffer.cond:
+        self.exhausted.set()
+        self.buffer.cond.notify_all()
+
+  def callback (self, n, wait=False):
+    """
+    Called by the sink, on its own thread, for the next n frames. If the
+    producer has fallen behind, the shortfall is filled with silence and
+    counted as an underrun, unless wait is set, when the sink would rather
+    wait for them. Fewer than n frames means the source is done.
+    """
+    if wait:
+      with self.buffer.cond:
+        self.buffer.cond.wait_for(lambda: len(self.buffer) >= n or
+                                  self.exhausted.is_set())
+    exhausted = self.exhausted.is_set()
+    frames = self.buffer.read(n)
+    if len(frames) < n:
+      if exhausted:
+        # The last frames there are: the sink stops after these
+        self.finished.set()
+      else:
+        self.underruns += 1
+        self.underrun_frames += n - len(frames)
+        frames = np.concatenate((frames, np.zeros((n - len(frames),
+                                                   self.channels),
+                                                  dtype=frames.dtype)))
+    self.frames_played += len(frames)
+    return frames
+
+  def start (self):
+    """
+    Start rendering, and start the sink once the buffer has filled.
+    """
+    self.producer = threading.Thread(target=self._produce, daemon=True)
+    self.producer.start()
+    with self.buffer.cond:
+      self.buffer.cond.wait_for(lambda: len(self.buffer) ==
+                                self.buffer.capacity or
+                                self.exhausted.is_set(), timeout=10)
+    self.sink.start(self)
+
+  def wait (self, timeout=None):
+    """
+    Wait for the sink to play the last frames, and raise whatever the source
+    raised, if it stopped short.
+    """
+    finished = self.finished.wait(timeout)
+    if self.error is not None:
+      raise self.error
+    return finished
+
+  def stop (self):
+    self.buffer.close()
+    self.sink.stop()
+    if self.producer:
+      self.producer.join()
+
+  def run (self):
+    """
+    Play the whole source and return the metrics.
+    """
+    self.start()
+    try:
+      self.wait()
+    finally:
+      self.stop()
+    return self.metrics()
+
+  def metrics (self):
+    rendered = self.frames_rendered / self.rate
+    return {
+      'underruns': self.underruns,
+      'underrun_frames': self.underrun_frames,
+      'frames_rendered': self.frames_rendered,
+      'frames_played': self.frames_played,
+      'buffered_frames': len(self.buffer),
+      'render_time': self.render_time,
+      'realtime_factor': rendered / self.render_time if self.render_time
+                         else None,
+    }
+
+class ThreadSink:
+  """
+  A sink that pulls a period at a time from a thread of its own.
+
+  realtime: Whether frames not ready in time are underruns. If not, the sink
+  waits for them instead.
+  paced: Whether to keep to a device's pace by the clock, for sinks with no
+  device to block on.
+  """
+
+  def __init__ (self, realtime=True, paced=True):
+    self.realtime = realtime
+    self.paced = paced
+    self.thread = None
+    self.stopping = False
+
+  def open (self, engine):
+    pass
+
+  def write (self, frames):
+    pass
+
+  def close (self):
+    pass
+
+  def start (self, engine):
+    self.open(engine)
+    self.stopping = False
+    self.thread = threading.Thread(target=self._run, args=(engine,),
+                                   daemon=True)
+    self.thread.start()
+
+  def _run (self, engine):
+    period_dur = engine.period / engine.rate
+    deadline = perf_counter()
+    while not self.stopping and not engine.finished.is_set():
+      frames = engine.callback(engine.period, wait=not self.realtime)
+      if len(frames):
+        self.write(frames)
+      if self.paced:
+        deadline += period_dur
+        sleep(max(0, deadline - perf_counter()))
+
+  def stop (self):
+    self.stopping = True
+    if self.thread:
+      self.thread.join()
+      self.thread = None
+    self.close()
+
+class NullSink (ThreadSink):
+  """
+  Discards everything, for running the engine headless.
+  """
+
+class FileSink (ThreadSink):
+  """
+  Writes 16-bit PCM to a file, or a path, as raw frames. By default as fast
+  as it is rendered, not at the pace of a device.
+  """
+
+  def __init__ (self, file, realtime=False):
+    super().__init__(realtime, paced=realtime)
+    self.file = file
+    self.owned = None
+
+  def open (self, engine):
+    self.encoder = PCMEncoder('int16', engine.channels, engine.period)
+    if isinstance(self.file, str):
+      self.owned = open(self.file, 'wb')
+
+  def write (self, frames):
+    (self.owned or self.file).write(self.encoder.encode(frames))
+
+  def close (self):
+    if self.owned:
+      self.owned.close()
+      self.owned = None
+
+class AlsaSink (ThreadSink):
+  """
+  Plays through ALSA, whose blocking writes keep the pace. The rate actually
+  set on the device is in rate once the sink is made.
+  """
+
+  def __init__ (self, rate, channels=1, period=1024):
+    import alsaaudio
+    super().__init__(paced=False)
+    self.out = alsaaudio.PCM()
+    self.out.setchannels(channels)
+    self.out.setformat(alsaaudio.PCM_FORMAT_S16_LE)
+    self.rate = self.out.setrate(rate)
+    self.period = self.out.setperiodsize(period)
+    self.encoder = PCMEncoder('int16', channels, self.period)
+
+  def write (self, frames):
+    self.out.write(self.encoder.encode(frames, self.period))
+
+  def close (self):
+    self.out.close()
+
+class PyAudioSink:
+  """
+  Plays through PortAudio, which pulls frames from its callback.
+  """
+
+  def __init__ (self):
+    self.pa = None
+    self.stream = None
+
+  def start (self, engine):
+    import pyaudio
+    # Made here, not on PortAudio's thread, which should never allocate
+    encoder = PCMEncoder('int16', engine.channels, engine.period)
+
+    def callback (in_data, frame_count, time_info, status):
+      frames = engine.callback(frame_count)
+      flag = (pyaudio.paContinue if len(frames) == frame_count else
+              pyaudio.paComplete)
+      # PyAudio copies it out before the next call
+      return encoder.encode(frames, frame_count).toreadonly(), flag
+
+    self.pa = pyaudio.PyAudio()
+    self.stream = self.pa.open(rate=engine.rate, format=pyaudio.paInt16,
+                               channels=engine.channels, output=True,
+                               frames_per_buffer=engine.period,
+                               stream_callback=callback)
+
+  def stop (self):
+    if self.stream:
+      self.stream.close()
+      self.pa.terminate()
+      self.stream = None
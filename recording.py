@@ -0,0 +1,232 @@
+"""
+Recorded waveforms, memory-mapped from WAV or raw PCM files, and the nodes
+that play them. Nothing is read until it is played, and then only the
+frames played, so large libraries open at once, and processes that map the
+same file share its pages.
+"""
+import os
+import struct
+import numpy as np
+from device import (Signal, Input, PhasedSignal, BandLimited, FrequencySignal,
+                    TriggerSignal, sample_times, render_input, stateful)
+
+# Sample formats: (numpy dtype, bytes per sample, full scale, offset)
+_formats = {
+  'uint8': ('u1', 1, 128, 128),
+  'int16': ('<i2', 2, 2**15, 0),
+  'int24': ('u1', 3, 2**23, 0),
+  'int32': ('<i4', 4, 2**31, 0),
+  'float32': ('<f4', 4, 1, 0),
+  'float64': ('<f8', 8, 1, 0),
+}
+
+# WAV (format tag, bits) to format
+_wav_formats = {
+  (1, 8): 'uint8',
+  (1, 16): 'int16',
+  (1, 24): 'int24',
+  (1, 32): 'int32',
+  (3, 32): 'float32',
+  (3, 64): 'float64',
+}
+
+class Recording:
+  """
+  The frames of a PCM file, mapped into memory, at offset bytes into it.
+  """
+
+  def __init__ (self, path, rate, format='int16', channels=1, offset=0,
+                frames=None):
+    if format not in _formats:
+      raise ValueError('Unknown sample format {!r}'.format(format))
+    dtype, width, self.scale, self.zero = _formats[format]
+    self.path = path
+    self.rate = rate
+    self.format = format
+    self.channels = channels
+
+    most = (os.path.getsize(path) - offset) // (width * channels)
+    frames = most if frames is None else min(frames, most)
+    shape = (frames, channels, 3) if format == 'int24' else (frames, channels)
+    self.data = np.memmap(path, dtype, 'r', offset, shape)
+
+  @classmethod
+  def wav (cls, path):
+    """
+    Map the samples of a WAV file, as its header describes them.
+    """
+    with open(path, 'rb') as f:
+      riff, size, wave = struct.unpack('<4sI4s', f.read(12))
+      if riff != b'RIFF' or wave != b'WAVE':
+        raise ValueError('{} is not a WAV file'.format(path))
+
+      fmt = None
+      while True:
+        header = f.read(8)
+        if len(header) < 8:
+          raise ValueError('{} has no data'.format(path))
+        chunk, size = struct.unpack('<4sI', header)
+        if chunk == b'fmt ':
+          # Chunks are padded out to an even size
+          body = f.read(size + size % 2)
+          tag, channels, rate = struct.unpack('<HHI', body[:8])
+          bits = struct.unpack('<H', body[14:16])[0]
+          if tag == 0xFFFE:
+            # WAVE_FORMAT_EXTENSIBLE, whose subformat starts with the tag
+            tag = struct.unpack('<H', body[24:26])[0]
+          fmt = (tag, bits)
+        elif chunk == b'data':
+          break
+        else:
+          f.seek(size + size % 2, os.SEEK_CUR)
+
+      if fmt not in _wav_formats:
+        raise ValueError('Unsupported WAV format {} in {}'.format(fmt, path))
+      format = _wav_formats[fmt]
+      offset = f.tell()
+
+    # Files streamed out without a length give the most there could be
+    frames = size // (_formats[format][1] * channels)
+    return cls(path, rate, format, channels, offset, frames)
+
+  def __getstate__ (self):
+    # Pickle where the frames are, not the frames, for them to be mapped again
+    state = dict(vars(self))
+    state['data'] = (self.data.offset, self.data.shape)
+    return state
+
+  def __setstate__ (self, state):
+    offset, shape = state['data']
+    vars(self).update(state)
+    self.data = np.memmap(self.path, _formats[self.format][0], 'r', offset,
+                          shape)
+
+  def __len__ (self):
+    return len(self.data)
+
+  def read (self, index, channel=0):
+    """
+    The frames at index, an array of frame numbers, as floats in [-1,1]:
+    from one channel, or the average of all when channel is None.
+    """
+    frames = self.data[index] if channel is None else self.data[index,
+                                                                channel]
+    if self.format == 'int24':
+      b = frames.astype(np.int32)
+      frames = b[..., 0] | b[..., 1] << 8 | b[..., 2] << 16
+      frames = (frames ^ 0x800000) - 0x800000
+    samples = (frames - self.zero) / self.scale
+    if channel is None:
+      samples = samples.mean(axis=-1)
+    return samples
+
+def load (path, rate=None, format='int16', channels=1):
+  """
+  Map a recording: a WAV file as its header says, or anything else as raw
+  frames of the given rate, format and channels.
+  """
+  if os.path.splitext(path)[1].lower() in ('.wav', '.wave'):
+    return Recording.wav(path)
+  if rate is None:
+    raise ValueError('A raw recording needs its rate')
+  return Recording(path, rate, format, channels)
+
+class SamplePlayer (Signal):
+  """
+  Plays a Recording, at its own pitch when freq is None, and otherwise
+  faster or slower by freq/root, interpolating between frames: 'linear',
+  'cubic', or None to take the frame below.
+
+  It plays once through, and then is silent, unless loop, a (start, end)
+  pair of frames, is given: then it plays on around the loop once it gets
+  there. A trigger starts it again from the beginning.
+  """
+  random_access = False
+  _initial = {'pos': 0.0, 'last_t': 0}
+  freq = Input(FrequencySignal, const_type=None)
+  trigger = Input(TriggerSignal)
+
+  def __init__ (self, recording, freq=None, root=440, trigger=None,
+                loop=None, channel=0, interpolation='linear'):
+    self.recording = recording
+    self.freq = root if freq is None else freq
+    self.root = root
+    if trigger is not None:
+      self.trigger = trigger
+    self.loop = loop
+    self.channel = channel
+    self.interpolation = interpolation
+    self.reset()
+
+  def __call__ (self, t):
+    f = self._call_freq(t) if callable(self._freq) else self._freq
+    trigger = self._call_trigger(t) if hasattr(self, '_trigger') else 0
+    return float(self._play(np.array([t]), f, trigger)[0])
+
+  @stateful
+  def render (self, start, n, rate):
+    trigger = 0
+    if hasattr(self, '_trigger'):
+      trigger = self._trigger.render(start, n, rate)
+    return self._play(sample_times(start, n, rate),
+                      render_input(self._freq, start, n, rate), trigger)
+
+  def _play (self, t, f, trigger):
+    """
+    The samples at times t, for frequency f, starting again wherever trigger
+    fires.
+    """
+    dt = np.diff(t, prepend=self.last_t)
+    pos = self.pos + np.cumsum(dt * f * (self.recording.rate / self.root))
+    for i in np.flatnonzero(np.broadcast_to(trigger, len(t))):
+      pos[i:] -= pos[i]
+
+    if self.loop:
+      begin, end = self.loop
+      pos = np.where(pos >= end, begin + (pos - begin) % (end - begin), pos)
+    self.pos = float(pos[-1])
+    self.last_t = t[-1]
+    return self._read(pos)
+
+  def _read (self, pos):
+    i = np.floor(pos).astype(np.intp)
+    frac = pos - i
+    if self.interpolation is None:
+      return self._frames(i)
+    p1 = self._frames(i)
+    p2 = self._frames(i + 1)
+    if self.interpolation == 'linear':
+      return p1 + frac*(p2 - p1)
+    if self.interpolation == 'cubic':
+      p0 = self._frames(i - 1)
+      p3 = self._frames(i + 2)
+      return p1 + 0.5*frac*(p2 - p0 + frac*(2*p0 - 5*p1 + 4*p2 - p3 +
+                                           frac*(3*(p1 - p2) + p3 - p0)))
+    raise ValueError('Unknown interpolation {!r}'.format(self.interpolation))
+
+  def _frames (self, i):
+    """
+    The frames at i, wrapped around the loop, and silent outside the
+    recording.
+    """
+    if self.loop:
+      begin, end = self.loop
+      i = np.where(i >= end, begin + (i - begin) % (end - begin), i)
+    inside = (i >= 0) & (i < len(self.recording))
+    samples = np.zeros(len(i))
+    samples[inside] = self.recording.read(i[inside], self.channel)
+    return samples
+
+def SingleCycle (recording, band_limited=False, size=2048,
+                 interpolation='linear'):
+  """
+  A PhasedSignal class whose cycle is the whole of recording, its channels
+  mixed down. A single cycle is small, so it is read into a table, and
+  band-limited like BandLimited() if asked.
+  """
+  class SingleCycle (PhasedSignal):
+    _phase = recording.read(np.arange(len(recording)), None)
+
+  if band_limited:
+    return BandLimited(SingleCycle, size, interpolation)
+  return SingleCycle
@@ -0,0 +1,173 @@
+"""
+Streaming sample rate conversion by rational ratios, through a polyphase
+FIR filter, for rendering at one rate and delivering at another.
+"""
+from copy import copy
+from fractions import Fraction
+from math import floor
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from device import (Signal, Input, render_input, stateful,
+                    DEFAULT_SAMPLERATE)
+
+def lowpass (up, down, taps, rolloff=0.9, beta=8.0):
+  """
+  The prototype filter for resampling by up/down: a Kaiser windowed sinc of
+  up*taps points at the upsampled rate, cut off a little below the lower of
+  the two Nyquist frequencies. Its gain is up, to make up for the zeros
+  upsampling stuffs in.
+
+  It is centred on a multiple of down, so its delay is a whole number of
+  output samples.
+  """
+  n = up * taps
+  centre = round((n - 1) / 2 / down) * down
+  cutoff = rolloff * 0.5 / max(up, down)
+  x = np.arange(n) - centre
+  half = max(centre, n - 1 - centre) or 1
+  window = np.i0(beta * np.sqrt(np.clip(1 - (x/half)**2, 0, 1))) / np.i0(beta)
+  h = 2*cutoff * np.sinc(2*cutoff * x) * window
+  return h * (up / h.sum())
+
+class Resampler:
+  """
+  Converts a stream of blocks to up/down times its rate. Only the taps
+  samples each output sample needs are ever read, one phase of the filter
+  for each, and blocks may be of any size: the filter's history and the
+  phase carry over from one to the next.
+
+  The output lags the input by delay, a whole number of output samples.
+  """
+
+  def __init__ (self, up, down, taps=16, rolloff=0.9):
+    ratio = Fraction(up, down)
+    self.up = ratio.numerator
+    self.down = ratio.denominator
+    self.taps = taps
+    h = lowpass(self.up, self.down, taps, rolloff)
+    # One row of taps per phase, reversed to line up with the window of
+    # input that ends at the sample it is centred on
+    self.kernels = np.ascontiguousarray(h.reshape(taps, self.up).T[:, ::-1])
+    self.delay = round((self.up*taps - 1) / 2 / self.down)
+
+    self.history = np.zeros(taps - 1)
+    # Input samples taken, and output samples made, so far
+    self.consumed = 0
+    self.made = 0
+
+  def process (self, block):
+    """
+    Take a block of input, and return as many samples of output as it
+    completes.
+    """
+    block = np.asarray(block, dtype=float)
+    buf = np.concatenate((self.history, block))
+    end = self.consumed + len(block)
+    # Output m is centred on input m*down/up, so is complete once that is in
+    made = -(-end*self.up // self.down)
+    u = np.arange(self.made, made) * self.down
+    windows = sliding_window_view(buf, self.taps)
+    out = np.einsum('ij,ij->i', windows[u // self.up - self.consumed],
+                    self.kernels[u % self.up])
+
+    if self.taps > 1:
+      self.history = buf[len(buf) - (self.taps - 1):]
+    self.consumed = end
+    self.made = made
+    return out
+
+def resample (blocks, from_rate, to_rate, taps=16):
+  """
+  Resample an iterable of blocks, such as util.blocks() gives, from one rate
+  to another. The delay is taken out, so the output lines up with the
+  input, and runs the same length.
+  """
+  ratio = Fraction(to_rate) / Fraction(from_rate)
+  r = Resampler(ratio.numerator, ratio.denominator, taps)
+  skip = r.delay
+  taken = 0
+  given = 0
+  for block in blocks:
+    out = r.process(block)
+    dropped = min(skip, len(out))
+    skip -= dropped
+    taken += len(block)
+    given += len(out) - dropped
+    if len(out) > dropped:
+      yield out[dropped:]
+
+  # Flush the filter, and trim to the length of the input at the new rate
+  left = -(-taken*r.up // r.down) - given
+  if left > 0:
+    zeros = np.zeros(-(-(skip + left)*r.down // r.up) + taps)
+    yield r.process(zeros)[skip:skip+left]
+
+class Resample (Signal):
+  """
+  Renders input at factor times the rate it is asked for, and resamples it
+  to that rate: a factor below 1 to render a cheap patch at a low rate, or
+  above 1 to oversample one that aliases, such as FM, and decimate it. The
+  filter's delay is taken out.
+
+  Blocks must follow on from one another, or start again somewhere, as
+  after a skip; each start again reads taps input samples before it.
+  Samples asked for one t at a time are taken to be at DEFAULT_SAMPLERATE.
+  """
+  random_access = False
+  _initial = {'resampler': None, 'pending': None, 'next_in': 0,
+              'next_out': 0}
+  input = Input()
+
+  def __init__ (self, input, factor, taps=16):
+    self.input = input
+    self.factor = Fraction(factor).limit_denominator(1000)
+    self.taps = taps
+    self.reset()
+
+  def _restart (self, start):
+    r = self.resampler = Resampler(self.factor.denominator,
+                                   self.factor.numerator, self.taps)
+    delay = r.delay
+    # Read from far enough back for the filter to fill, from an input
+    # sample an output sample is centred on, so the phases line up
+    first = (start + delay) * r.down // r.up - self.taps
+    self.next_in = max(0, first // r.down * r.down)
+    self.next_out = self.next_in * r.up // r.down - delay
+    self.pending = np.empty(0)
+
+  @stateful
+  def render (self, start, n, rate):
+    if self.resampler is None or start != self.next_out:
+      self._restart(start)
+
+    r = self.resampler
+    inner = rate * self.factor
+    if isinstance(inner, Fraction):
+      inner = int(inner) if inner.denominator == 1 else float(inner)
+    pending = [self.pending]
+    have = len(self.pending)
+    while self.next_out + have < start + n:
+      count = ((start + n - self.next_out - have) * r.down // r.up +
+               self.taps)
+      block = np.broadcast_to(render_input(self._input, self.next_in, count,
+                                           inner), count)
+      self.next_in += count
+      pending.append(r.process(block))
+      have += len(pending[-1])
+
+    pending = np.concatenate(pending)[start - self.next_out:]
+    self.pending = pending[n:]
+    self.next_out = start + n
+    return pending[:n]
+
+  def __call__ (self, t):
+    index = floor(t * DEFAULT_SAMPLERATE + 0.5)
+    return self.render(index, 1, DEFAULT_SAMPLERATE)[0]
+
+  def snapshot (self):
+    state = super().snapshot()
+    state['resampler'] = copy(state['resampler'])
+    return state
+
+  def restore (self, state):
+    super().restore(dict(state, resampler=copy(state['resampler'])))
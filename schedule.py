@@ -0,0 +1,145 @@
+"""
+Sample-accurate event scheduling, so renderers can work in straight runs
+between events rather than checking for them every sample.
+"""
+import heapq
+from bisect import bisect_left
+from math import floor
+from collections import namedtuple
+from itertools import count
+
+# Note on: the value changes, the trigger fires and the gate opens.
+ON = 'on'
+# Note off: the gate closes.
+OFF = 'off'
+
+Event = namedtuple('Event', 'index kind value')
+
+def notes (steps):
+  """
+  The (time, kind, value) events for a sequence of (value, dur) steps, where
+  a value of None is a rest. Times are summed from the start, so they never
+  drift.
+  """
+  t = 0
+  for value, dur in steps:
+    if value is None:
+      yield t, OFF, None
+    else:
+      yield t, ON, value
+    t += dur
+  yield t, OFF, None
+
+def merge (*parts):
+  """
+  The (start, value, dur) notes of several parts, each a sequence of (value,
+  dur) steps, in order of start.
+  """
+  def part (steps):
+    t = 0
+    for value, dur in steps:
+      if value is not None:
+        yield t, value, dur
+      t += dur
+  return heapq.merge(*map(part, parts), key=lambda note: note[0])
+
+def note_events (notes):
+  """
+  The (time, kind, value) events for (start, value, dur) notes in order of
+  start. A note on's value is (value, note number); a note off's is the note
+  number. Notes may overlap, so the offs wait in a queue of their own.
+  """
+  offs = []
+  for number, (start, value, dur) in enumerate(notes):
+    while offs and offs[0][0] <= start:
+      time, off = heapq.heappop(offs)
+      yield time, OFF, off
+    yield start, ON, (value, number)
+    heapq.heappush(offs, (start + dur, number))
+  while offs:
+    time, number = heapq.heappop(offs)
+    yield time, OFF, number
+
+class Scheduler:
+  """
+  A priority queue of events at sample indices for one sample rate. Events
+  can be pushed one at a time or fed from sources, iterables of (time, kind,
+  value) in time order, which are only read as far as rendering has got.
+
+  Events that have come due are kept, so any span can be asked for again.
+  """
+
+  def __init__ (self, rate):
+    self.rate = rate
+    self.queue = []
+    self.past = []
+    self.indices = []
+    self.order = count()
+
+  def index (self, time):
+    """
+    The sample index nearest to time, rounding halves up.
+    """
+    return floor(time * self.rate + 0.5)
+
+  def push (self, time, kind, value=None, source=None):
+    self.push_at(self.index(time), kind, value, source)
+
+  def push_at (self, index, kind, value=None, source=None):
+    heapq.heappush(self.queue, (index, next(self.order), kind, value, source))
+
+  def add (self, source):
+    """
+    Schedule the events from source as they come due.
+    """
+    source = iter(source)
+    for time, kind, value in source:
+      self.push(time, kind, value, source)
+      break
+
+  def _advance (self, end):
+    queue = self.queue
+    while queue and queue[0][0] < end:
+      index, order, kind, value, source = heapq.heappop(queue)
+      self.past.append(Event(index, kind, value))
+      self.indices.append(index)
+      if source is not None:
+        for time, kind, value in source:
+          self.push(time, kind, value, source)
+          break
+
+  def span (self, start, end):
+    """
+    The events from index start up to end, in order.
+    """
+    self._advance(end)
+    return self.past[bisect_left(self.indices, start):
+                     bisect_left(self.indices, end)]
+
+  def before (self, index):
+    """
+    The events before index, latest first.
+    """
+    self._advance(index)
+    # Walked back from index, so only the events looked at are read
+    past = self.past
+    for i in range(bisect_left(self.indices, index) - 1, -1, -1):
+      yield past[i]
+
+  def split (self, start, n):
+    """
+    Split the n samples from start at every event. Yields (offset, length,
+    events) for each run, where events are those that happen at its first
+    sample.
+    """
+    events = self.span(start, start + n)
+    offset = 0
+    i = 0
+    while offset < n:
+      j = i
+      while j < len(events) and events[j].index - start == offset:
+        j += 1
+      end = events[j].index - start if j < len(events) else n
+      yield offset, end - offset, events[i:j]
+      offset = end
+      i = j
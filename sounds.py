@@ -1,14 +1,72 @@
 import math
-from util import cimethod
-
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import islice
+import numpy as np
+from util import cimethod, blocks
+from context import RenderContext
+
+# The default context, for generators not given one
 SAMPLERATE = 44100
 SAMPLEDUR = 1/SAMPLERATE * 1000
 
 def set_samplerate (sr):
   global SAMPLERATE, SAMPLEDUR
+  if sr != SAMPLERATE:
+    with _tables_lock:
+      _tables.clear()
   SAMPLERATE = sr
   SAMPLEDUR = 1/SAMPLERATE * 1000
 
+def default_context ():
+  return RenderContext(SAMPLERATE)
+
+# Tables of one period, by wave, sample rate and frequency, for as many
+# notes as are likely to come back. The least recently used go first.
+TABLE_CACHE_SIZE = 256
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+
+def _wave_key (wave):
+  """
+  What tells a wave's tables apart: its class, or an instance's class and
+  parameters.
+  """
+  if isinstance(wave, type):
+    return wave
+  try:
+    params = tuple(sorted(vars(wave).items()))
+    hash(params)
+  except TypeError:
+    params = id(wave)
+  return (type(wave), params)
+
+# The fewest points a table has, for interpolating high notes smoothly
+TABLE_MIN_SIZE = 64
+
+def _table (wave, freq, rate):
+  """
+  One period of wave at freq, sampled at as many points as the period has
+  samples at rate, rounded up, or TABLE_MIN_SIZE if that's more. The first
+  point is repeated at the end, to interpolate up to the end of the period.
+  """
+  key = (_wave_key(wave), rate, freq)
+  with _tables_lock:
+    table = _tables.get(key)
+    if table is not None:
+      _tables.move_to_end(key)
+      return table
+
+  n = max(TABLE_MIN_SIZE, math.ceil(rate / freq))
+  table = np.array([wave._sample(wave._period*i/n) for i in range(n)] +
+                   [wave._sample(0)], dtype=float)
+  with _tables_lock:
+    _tables[key] = table
+    if len(_tables) > TABLE_CACHE_SIZE:
+      _tables.popitem(last=False)
+  return table
+
 
 _clamp = lambda x,l,h: min(max(l,x), h)
 _tau = 2*math.pi
@@ -16,17 +74,18 @@ _tau = 2*math.pi
 class Silence:
 
   @staticmethod
-  def gen (dur):
+  def gen (dur, context=None):
     """
     A generator of data for this sound at a given freqency and samplerate for
     the specified duration.
 
     freq -> Note frequency.
     dur -> Duration in seconds
-    samplerate -> Sample points generated per second of duration.
+    context -> The RenderContext, whose rate is the sample points generated
+               per second of duration.
     """
-
-    for _ in range(int(SAMPLERATE * dur)):
+    context = context or default_context()
+    for _ in range(int(context.rate * dur)):
       yield 0
 
 class PeriodicWave:
@@ -41,11 +100,41 @@ class PeriodicWave:
     return [cls._sample(t) for t in (0,0.125,0.25,0.375,0.5,0.625,0.75,0.875,1)]
 
   @cimethod
-  def gen (cls, freq, dur):
-    period = int(SAMPLERATE / freq)
-    data = [cls._sample(cls._period*i/period) for i in range(period)]
-    for i in range(int(SAMPLERATE * dur)):
-      yield data[i % period]
+  def gen (cls, freq, dur, context=None):
+    for block in cls.blocks(freq, dur, context=context):
+      yield from block.tolist()
+
+  @cimethod
+  def blocks (cls, freq, dur, size=None, context=None):
+    """
+    The samples gen() makes, in arrays of up to size, by default the
+    context's block size. A phase accumulator steps through a cached table
+    of one period by a fractional increment, interpolating, so the pitch is
+    exact whether or not the period is a whole number of samples.
+    """
+    context = context or default_context()
+    table = _table(cls, freq, context.rate)
+    for start, phase in _phases(freq, dur, len(table) - 1,
+                                size or context.block_size, context.rate):
+      yield _lookup(table, phase).astype(context.dtype, copy=False)
+
+def _phases (freq, dur, n, size, rate):
+  """
+  For each block of up to size samples of a note, its start and the phase
+  of each of its samples, in points of a table of n points a period.
+  """
+  inc = n * freq / rate
+  phase = 0.0
+  steps = np.arange(size) * inc
+  total = int(rate * dur)
+  for start in range(0, total, size):
+    count = min(size, total - start)
+    yield start, (phase + steps[:count]) % n
+    phase = (phase + count*inc) % n
+
+def _lookup (table, phase):
+  i = phase.astype(np.intp)
+  return table[i] + (phase - i)*(table[i + 1] - table[i])
 
 class SineWave (PeriodicWave):
   _period = _tau
@@ -94,24 +183,75 @@ class Envelope:
     self.sustain = sustain
     self.release = release
 
-  def gen (self, sound, freq, dur):
+  def gen (self, sound, freq, dur, context=None):
+    """
+    Envelop sound's samples for a note of freq lasting dur seconds. Each
+    stage is a straight line over a run of samples, worked out once when the
+    stage starts, so a sustain costs one multiply a sample.
+    """
+    context = context or default_context()
+    sample_dur = context.sample_dur
     decay_idx = self.attack + self.decay
     release_idx = dur*1000 - self.release
-    idx = 0
-    for samp in sound.gen(freq, dur):
-      if idx < self.attack:
-        factor = idx/self.attack
-      elif idx < decay_idx:
-        factor = 1 - (idx - self.attack)/self.decay*(1 - self.sustain)
-      elif idx < release_idx:
-        factor = self.sustain
+    # Each stage: (idx it ends at, factor at idx 0, change in factor per ms)
+    stages = [
+      (self.attack, 0, 1/self.attack if self.attack else 0),
+      (decay_idx, 1 + self.attack/self.decay*(1 - self.sustain)
+                  if self.decay else 0,
+       -(1 - self.sustain)/self.decay if self.decay else 0),
+      (release_idx, self.sustain, 0),
+      (math.inf, self.sustain + release_idx/self.release*self.sustain
+                 if self.release else 0,
+       -self.sustain/self.release if self.release else 0),
+    ]
+
+    samples = iter(sound.gen(freq, dur, context=context))
+    i = 0
+    for end, factor, slope in stages:
+      # A sample is in the stage while its idx is short of the stage's end
+      end = math.ceil(end / sample_dur) if end < math.inf else None
+      if end is not None and end <= i:
+        continue
+      run = islice(samples, None if end is None else end - i)
+
+      if slope:
+        factor += slope*i*sample_dur
+        step = slope*sample_dur
+        for samp in run:
+          yield samp*factor
+          factor += step
+          i += 1
       else:
-        factor = self.sustain - (idx - release_idx)/self.release*self.sustain
-
-      yield samp*factor
-      idx += SAMPLEDUR
+        for samp in run:
+          yield samp*factor
+          i += 1
+
+# Points in a period of an FM table, and the spacing of the indices the
+# tables for a time-varying I are made for
+FM_TABLE_SIZE = 4096
+FM_INDEX_STEP = 0.25
+# Samples between evaluations of a time-varying I
+FM_CONTROL_PERIOD = 32
+
+@lru_cache(maxsize=256)
+def _fm_table (I, H, fund, mod):
+  """
+  One period of FM with index I and (scaled) ratio H, in FM_TABLE_SIZE
+  points and one more to wrap around to. The timbre is the same at every
+  pitch, so every note of every synth with these parameters shares it.
+  """
+  t = fund._period * np.arange(FM_TABLE_SIZE + 1) / FM_TABLE_SIZE
+  t[-1] = 0
+  if fund is SineWave and mod is SineWave:
+    return np.sin(t + I*np.sin(H*t))
+  return np.array([fund._sample(x + I*mod._sample(H*x)) for x in t])
 
 class FMSynth (PeriodicWave):
+  """
+  Sounds at any pitch are read from one table of its timbre. I may be a
+  function of the time into the note, in seconds, for which tables of
+  indices FM_INDEX_STEP apart are blended.
+  """
   def __init__ (self, I, H, fund=SineWave, mod=SineWave):
     self.fund = fund
     self.mod = mod
@@ -123,12 +263,56 @@ class FMSynth (PeriodicWave):
     return self.fund._period
 
   def _sample (self, t):
-    return self.fund._sample(t + self.I*self.mod._sample(self.H*t))
+    I = self.I(0) if callable(self.I) else self.I
+    return self.fund._sample(t + I*self.mod._sample(self.H*t))
+
+  def _table (self, I):
+    return _fm_table(I, self.H, self.fund, self.mod)
+
+  def blocks (self, freq, dur, size=None, context=None):
+    context = context or default_context()
+    rate = context.rate
+    phases = _phases(freq, dur, FM_TABLE_SIZE, size or context.block_size,
+                     rate)
+    if not callable(self.I):
+      table = self._table(self.I)
+      for start, phase in phases:
+        yield _lookup(table, phase).astype(context.dtype, copy=False)
+      return
+
+    for start, phase in phases:
+      # I at control rate, interpolated in between
+      n = len(phase)
+      at = np.arange(0, n + FM_CONTROL_PERIOD, FM_CONTROL_PERIOD)
+      I = np.interp(np.arange(n), at, [self.I((start + i) / rate)
+                                       for i in at])
+      k = I / FM_INDEX_STEP
+      lo = np.floor(k)
+      w = k - lo
+      block = np.empty(n)
+      for j in np.unique(lo):
+        mask = lo == j
+        p = phase[mask]
+        a = _lookup(self._table(j * FM_INDEX_STEP), p)
+        b = _lookup(self._table((j + 1) * FM_INDEX_STEP), p)
+        block[mask] = a + w[mask]*(b - a)
+      yield block.astype(context.dtype, copy=False)
 
 class Filter:
-  def sample (self, input):
-    for samp in input:
-      yield _clamp(self._sample(samp), -1, 1)
+  """
+  Filters a generator of samples a block of the context's block size at a
+  time, clipping the output to [-1,1]. A subclass overrides process() to
+  filter a whole block at once, or _sample() to filter one sample at a
+  time.
+  """
+
+  def sample (self, input, context=None):
+    context = context or default_context()
+    for block in blocks(iter(input), context.block_size):
+      yield from np.clip(self.process(block, context.rate), -1, 1).tolist()
+
+  def process (self, block, rate=None):
+    return np.fromiter(map(self._sample, block), float, len(block))
 
   def _sample (self, samp):
     return samp
@@ -137,6 +321,9 @@ class Volume (Filter):
   def __init__ (self, vol):
     self.vol = vol
 
+  def process (self, block, rate=None):
+    return block * self.vol
+
   def _sample (self, samp):
     return samp * self.vol
 
@@ -1,6 +1,8 @@
 import array
+import numpy as np
 from itertools import islice
 from functools import partial, wraps
+from operator import attrgetter
 
 class classproperty (object):
 
@@ -48,31 +50,123 @@ def _int16 (f):
   v = int(f * 32767)
   return v if -32767 <= v <= 32767 else clamp(v, -32767, 32767)
 
-def chunk(iter, size):
-  a = array.array('h', (0 for x in range(size)))
-
+def chunk (iter, size):
+  """
+  16-bit PCM for size samples of iter at a time, the last zero padded. Each
+  chunk is a memoryview of one buffer, good until the next is asked for.
+  """
+  encoder = PCMEncoder(frames=size)
+  for block in blocks(iter, size):
+    yield encoder.encode(block, size)
+
+def blocks (iter, size):
+  """
+  Gather an iterable of samples into arrays of size samples. The last may be
+  short.
+  """
   while True:
-
-    i = -1
-    for i, samp in enumerate(islice(iter, size)):
-      a[i] = _int16(samp)
-
-    if i == -1:
+    block = np.fromiter(islice(iter, size), float)
+    if not len(block):
       break
+    yield block
 
-    if i < size -1:
-      for i in range(i+1, size):
-        a[i] = 0
+def byte_array (iter):
+  a = array.array('h')
+  a.frombytes(PCMEncoder().encode(np.fromiter(iter, float)))
+  return a
+
+def pcm16 (block, size=None):
+  """
+  Encode a block of samples as 16-bit PCM bytes the way _int16 does, zero
+  padded out to size samples.
+  """
+  return bytes(PCMEncoder().encode(block, size))
+
+# PCM sample formats: (bytes per sample, full scale), with floats unscaled
+_formats = {
+  'int16': (2, 32767),
+  'int24': (3, 8388607),
+  'float32': (4, None),
+}
+
+class PCMEncoder:
+  """
+  Encodes blocks of samples in [-1,1] as little-endian PCM: 'int16', 'int24'
+  or 'float32'. Samples are clipped, and for the integer formats scaled and
+  truncated the way _int16 does. A block of (frames, channels) comes out
+  with its channels interleaved.
+
+  The PCM goes into a buffer kept from one block to the next, only grown
+  when a block doesn't fit, and comes back as a memoryview of it, good
+  until the next encode().
+
+  big_endian: Encode most significant byte first, as AIFF wants.
+  """
+
+  def __init__ (self, format='int16', channels=1, frames=0, big_endian=False):
+    if format not in _formats:
+      raise ValueError('Unknown PCM format {!r}'.format(format))
+    self.format = format
+    self.channels = channels
+    self.order = '>' if big_endian else '<'
+    self.width, self.scale = _formats[format]
+    self.capacity = -1
+    self._reserve(frames)
+
+  def _reserve (self, samples):
+    if samples <= self.capacity:
+      return
+    self.capacity = samples
+    self.buffer = bytearray(samples * self.width)
+    self.scratch = np.empty(samples)
+    if self.format == 'int24':
+      self.wide = np.empty(samples, dtype=self.order + 'i4')
+      self.out = np.frombuffer(self.buffer, np.uint8).reshape(samples, 3)
+    else:
+      self.out = np.frombuffer(self.buffer, self.order +
+                               ('i2' if self.format == 'int16' else 'f4'))
+
+  def encode (self, block, frames=None):
+    """
+    Encode block, zero padded out to frames frames.
+    """
+    block = np.asarray(block, dtype=float).reshape(-1)
+    n = len(block)
+    total = max(n, (frames or 0) * self.channels)
+    self._reserve(total)
+
+    scratch = self.scratch[:n]
+    if self.scale is None:
+      np.clip(block, -1, 1, out=scratch)
+    else:
+      np.multiply(block, self.scale, out=scratch)
+      np.trunc(scratch, out=scratch)
+      np.clip(scratch, -self.scale, self.scale, out=scratch)
+
+    if self.format == 'int24':
+      wide = self.wide[:n]
+      np.copyto(wide, scratch, casting='unsafe')
+      # The three low bytes of each
+      low = slice(1, None) if self.order == '>' else slice(None, 3)
+      self.out[:n] = wide.view(np.uint8).reshape(n, 4)[:, low]
+    else:
+      np.copyto(self.out[:n], scratch, casting='unsafe')
+    self.out[n:total] = 0
 
-    yield a.tobytes()
+    return memoryview(self.buffer)[:total * self.width]
 
-def byte_array (iter):
-  return array.array('h', (_int16(s) for s in iter))
 
+class NamedDescriptor (property):
+  """
+  An attribute kept on the instance under varname, its name with an
+  underscore before it. Reads are a property's, so they never leave C.
+  """
+  def __init__ (self):
+    pass
 
-class NamedDescriptor:
-  def __get__ (self, instance, owner):
-    return getattr(instance, self.varname)
+  def name (self, varname):
+    self.varname = varname
+    property.__init__(self, attrgetter(varname))
 
   def __set__ (self, instance, value):
     setattr(instance, self.varname, value)
@@ -81,7 +175,7 @@ class NamedMeta (type):
   def __new__ (cls, name, bases, namespace):
     for varname, var in namespace.items():
       if isinstance(var, NamedDescriptor):
-        var.varname = '_' + varname
+        var.name('_' + varname)
     return type.__new__(cls, name, bases, namespace)
 
 def configable (func):
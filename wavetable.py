@@ -0,0 +1,134 @@
+"""
+Band-limited wavetables for PhasedSignal oscillators.
+"""
+from functools import lru_cache
+from math import pi
+import numpy as np
+import os
+
+# Where fourier_table() keeps tables between runs, if anywhere
+cache_dir = os.environ.get('AUDIO_TABLE_CACHE')
+
+_tau = 2*pi
+
+def _series (shape, n):
+  """
+  The harmonic numbers and amplitudes of the first n sine terms of shape.
+  """
+  k = np.arange(1, n+1)
+  if shape == 'saw':
+    return k, 2/pi / k
+  if shape == 'square':
+    return 2*k - 1, 4/pi / (2*k - 1)
+  if shape == 'triangle':
+    return 2*k - 1, 8/pi**2 * (-1.0)**k / (2*k - 1)**2
+  raise ValueError('Unknown shape {!r}'.format(shape))
+
+@lru_cache(maxsize=None)
+def fourier_table (shape, harmonics, size=1024):
+  """
+  One cycle of size samples of the Fourier series for shape ('saw', 'square'
+  or 'triangle') summed to the given number of terms.
+
+  Tables are built once per process, and kept in cache_dir, when it is set,
+  to be loaded rather than built by later processes.
+  """
+  path = None
+  if cache_dir:
+    path = os.path.join(cache_dir, '{}-{}-{}.npy'.format(shape, harmonics,
+                                                         size))
+    try:
+      table = np.load(path)
+      table.flags.writeable = False
+      return table
+    except (OSError, ValueError):
+      pass
+
+  h, amps = _series(shape, harmonics)
+  p = np.arange(size)
+  table = amps @ np.sin(_tau*h[:, None] * p/size)
+  table.flags.writeable = False
+
+  if path:
+    os.makedirs(cache_dir, exist_ok=True)
+    # Written aside and moved into place, so a reader never sees half a table
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+      np.save(f, table)
+    os.replace(tmp, path)
+
+  return table
+
+class Wavetable:
+  """
+  A single-cycle waveform kept as a stack of tables, one per octave, each
+  holding half the harmonics of the one before. A lookup picks, per sample,
+  the richest table that has no harmonics above Nyquist at the current phase
+  increment, and interpolates within it.
+  """
+
+  def __init__ (self, cycle, size=2048):
+    """
+    cycle: One period of the waveform, sampled at any resolution.
+    size: Samples per table. Must be a power of two.
+    """
+    if size < 4 or size & (size - 1):
+      raise ValueError('Wavetable size must be a power of two, not {}'
+                       .format(size))
+    self.size = size
+
+    spectrum = np.fft.rfft(cycle)
+    bins = np.zeros(size//2 + 1, dtype=complex)
+    keep = min(len(spectrum), len(bins))
+    bins[:keep] = spectrum[:keep] * (size / len(cycle))
+    # Nothing at or above Nyquist even in the richest table
+    bins[size//2:] = 0
+
+    levels = size.bit_length() - 1
+    # Padded with one sample before and two after a cycle, so the points
+    # around any index can be read without wrapping.
+    self.tables = np.empty((levels, size + 3))
+    for level in range(levels):
+      bins[(size//2 >> level) + 1:] = 0
+      table = np.fft.irfft(bins, size)
+      self.tables[level, 1:-2] = table
+      self.tables[level, 0] = table[-1]
+      self.tables[level, -2:] = table[:2]
+    self._flat = self.tables.ravel()
+
+  def lookup (self, phase, inc, interpolation='linear'):
+    """
+    Sample the waveform at phase, in cycles [0,1), for a phase increment of
+    inc cycles per sample. Both may be arrays.
+
+    interpolation: 'linear', 'cubic', or None to take the nearest sample
+    below.
+    """
+    # ceil(log2(x)), without the log
+    m, e = np.frexp(np.abs(inc) * self.size)
+    # Plain ufuncs, as np.clip's checks cost more than the clipping
+    level = np.minimum(np.maximum(e - (m == 0.5), 0), len(self.tables) - 1)
+
+    pos = np.asarray(phase) * self.size
+    i = pos.astype(np.intp)
+    frac = pos - i
+    # Index the flattened stack of tables in one go
+    i += level * (self.size + 3) + 1
+
+    tables = self._flat
+    p1 = tables.take(i)
+    if interpolation is None:
+      return p1
+
+    p2 = tables.take(i + 1)
+    if interpolation == 'linear':
+      return p1 + frac*(p2 - p1)
+
+    if interpolation == 'cubic':
+      # Catmull-Rom
+      p0 = tables.take(i - 1)
+      p3 = tables.take(i + 2)
+      return p1 + 0.5*frac*(p2 - p0 + frac*(2*p0 - 5*p1 + 4*p2 - p3 +
+                                           frac*(3*(p1 - p2) + p3 - p0)))
+
+    raise ValueError('Unknown interpolation {!r}'.format(interpolation))
@@ -0,0 +1,175 @@
+"""
+Streaming audio file writers. Blocks are encoded as they come and written
+out in large writes, so memory use stays the same however long the render.
+"""
+import os
+import struct
+from math import frexp
+from util import PCMEncoder
+
+class Writer:
+  """
+  Writes blocks of samples, (frames,) or (frames, channels), to file, a path
+  or a binary file object, as PCM: 'int16', 'int24' or 'float32'.
+
+  Writes go out in whole buffers of buffer_frames frames. A header is
+  written up front with the sizes left open, and patched on close when the
+  file can seek. A pipe can't, so it keeps sizes that mean "to the end".
+
+  A RenderContext may be given for the rate and channels, in place of them.
+  """
+  big_endian = False
+
+  def __init__ (self, file, rate=None, channels=None, format='int16',
+                buffer_frames=16384, context=None):
+    if context is not None:
+      rate = context.rate if rate is None else rate
+      channels = context.channels if channels is None else channels
+    if rate is None:
+      raise ValueError('A writer needs a rate, or a context to take it from')
+    self.rate = rate
+    self.channels = channels or 1
+    self.format = format
+    self.encoder = PCMEncoder(format, self.channels, buffer_frames,
+                              self.big_endian)
+    self.frame_size = self.encoder.width * self.channels
+    self.frames = 0
+
+    self.owned = isinstance(file, str)
+    self.file = open(file, 'wb') if self.owned else file
+    self.buffer = bytearray(buffer_frames * self.frame_size)
+    self.used = 0
+
+    self.file.write(self.header(None))
+
+  def header (self, frames):
+    """
+    The bytes before the samples, for frames frames, or for as many as there
+    turn out to be when frames is None.
+    """
+    return b''
+
+  def write (self, block):
+    data = self.encoder.encode(block)
+    self.frames += len(data) // self.frame_size
+    if self.used + len(data) > len(self.buffer):
+      self.flush()
+    if len(data) >= len(self.buffer):
+      self.file.write(data)
+    else:
+      self.buffer[self.used:self.used+len(data)] = data
+      self.used += len(data)
+
+  def flush (self):
+    if self.used:
+      self.file.write(memoryview(self.buffer)[:self.used])
+      self.used = 0
+    self.file.flush()
+
+  def close (self):
+    self.flush()
+    self.finish()
+    if self.owned:
+      self.file.close()
+
+  def finish (self):
+    """
+    Pad the data out as the format needs, and patch the header with its
+    size if the file can seek.
+    """
+    if self.frames * self.frame_size % 2:
+      self.file.write(b'\0')
+    if not self.header(None) or not _seekable(self.file):
+      return
+
+    end = self.file.tell()
+    self.file.seek(0)
+    self.file.write(self.header(self.frames))
+    self.file.seek(end)
+    self.file.flush()
+
+  def __enter__ (self):
+    return self
+
+  def __exit__ (self, *exc):
+    self.close()
+
+def _seekable (file):
+  try:
+    return file.seekable()
+  except (AttributeError, OSError):
+    return False
+
+class RawWriter (Writer):
+  """
+  Bare samples, with no header.
+  """
+
+  def finish (self):
+    pass
+
+class WavWriter (Writer):
+
+  def header (self, frames):
+    size = 0xFFFFFFFF - 37 if frames is None else frames * self.frame_size
+    bits = self.encoder.width * 8
+    # PCM, or IEEE float
+    tag = 3 if self.format == 'float32' else 1
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + size + size % 2,
+                       b'WAVE', b'fmt ', 16, tag, self.channels, self.rate,
+                       self.rate * self.frame_size, self.frame_size, bits,
+                       b'data', size)
+
+def _extended (x):
+  """
+  x as an 80-bit IEEE 754 extended float, as AIFF gives its sample rate.
+  """
+  if not x:
+    return bytes(10)
+  m, e = frexp(x)
+  return struct.pack('>HQ', 16382 + e, int(m * 2**64))
+
+class AiffWriter (Writer):
+  """
+  AIFF for integer samples, and AIFF-C for floats.
+  """
+  big_endian = True
+
+  def header (self, frames):
+    if frames is None:
+      frames = 0x7FFFFFFF // self.frame_size
+    size = frames * self.frame_size
+    bits = self.encoder.width * 8
+    comm = struct.pack('>hIh', self.channels, frames, bits)
+    comm += _extended(self.rate)
+    chunks = b''
+    if self.format == 'float32':
+      comm += b'fl32' + b'\x0cIEEE float32\0'
+      # The AIFF-C version of 1990
+      chunks += struct.pack('>4sII', b'FVER', 4, 0xA2805140)
+    chunks += struct.pack('>4sI', b'COMM', len(comm)) + comm
+    chunks += struct.pack('>4sIII', b'SSND', 8 + size, 0, 0)
+    form = b'AIFC' if self.format == 'float32' else b'AIFF'
+    return struct.pack('>4sI4s', b'FORM', 4 + len(chunks) + size + size % 2,
+                       form) + chunks
+
+_writers = {
+  '.wav': WavWriter,
+  '.wave': WavWriter,
+  '.aif': AiffWriter,
+  '.aiff': AiffWriter,
+  '.aifc': AiffWriter,
+  '.raw': RawWriter,
+  '.pcm': RawWriter,
+}
+
+def open_writer (path, rate=None, channels=None, format='int16', type=None,
+                 **kwargs):
+  """
+  A Writer for path, of the type its extension names unless type does:
+  'wav', 'aiff' or 'raw'. The rest, context among them, go to the Writer.
+  """
+  ext = '.' + type if type else os.path.splitext(path)[1].lower()
+  if ext not in _writers:
+    raise ValueError('Unknown audio file type {!r}'.format(ext))
+  return _writers[ext](path, rate, channels, format, **kwargs)